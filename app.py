@@ -1,19 +1,89 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-import cv2
-import face_recognition
-import numpy as np
 import os
+import threading
+import zlib
 from datetime import datetime, date
-import base64
-from PIL import Image
-import io
-import pickle
+from concurrent.futures import ThreadPoolExecutor
+
+from daily_summary import day_summary, record_enrollment, record_presences
+from database import insert_new_rows, migrate, sqlite_engine_options
+from encoding_format import FORMAT_VERSION, EncodingFormatError, pack_encoding, unpack_encoding, unpack_encodings
+from events import EventNotifier, event_stream, parse_event_id
+from face_encoders import make_encoder
+from face_index import make_index
+from gallery import FaceGallery
+from image_io import Frame, request_data, request_flag, request_image_bytes, request_image_list
+from jobs import JobQueue, JobQueueFull, job_event_stream
+from reports import (
+    EXPORT_FORMATS, attendance_range_report, export_rows, parse_date_range, roster_version, student_page
+)
+from recognition_workers import PoolBusy, RecognitionPool
+from tracking import burst_encodings
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'rural-school-attendance-system-2024'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///attendance.db'
+# Database URL; DATABASE_URL points a run (e.g. benchmarks.py) at another database
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///attendance.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pooled connections (WAL and pragmas are set per connection in database.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_engine_options()
+# Longest side (pixels) frames are downscaled to before face detection;
+# None detects on the full-resolution frame
+app.config['DETECT_MAX_SIDE'] = 640
+# Face detector (see detectors.py): 'hog' (dlib), 'cnn' (dlib, practical
+# only with CUDA), 'haar', or 'cascade' (Haar candidates go straight to
+# dlib landmarks and encodings, optionally confirmed by HOG on each crop),
+# and options per detector name, e.g. {'hog': {'upsample': 0}} or
+# {'cascade': {'min_size': 40, 'verify': True}}
+app.config['FACE_DETECTOR'] = os.environ.get('FACE_DETECTOR', 'hog')
+app.config['FACE_DETECTOR_OPTIONS'] = {}
+# Faces found in recently seen frames, keyed by the decoded pixels, so a
+# resubmitted capture skips detection and encoding: entries kept in memory
+# (0 disables the cache), and a directory for an on-disk tier shared by
+# workers and restarts. The disk tier stores face encodings, so it is off
+# (None) unless set here, e.g. to 'encoding_cache_dlib'
+app.config['ENCODING_CACHE_SIZE'] = 256
+app.config['ENCODING_CACHE_DIR'] = None
+app.config['ENCODING_CACHE_DISK_SIZE'] = 4096
+# Most frames accepted by /api/mark_attendance_batch
+app.config['BATCH_MAX_FRAMES'] = 10
+# Burst capture (/api/mark_attendance_burst): most frames per burst, the
+# overlap (IoU) that links face boxes of consecutive frames into one track,
+# the frames a track must appear in, and the sharpest crops encoded per track
+app.config['BURST_MAX_FRAMES'] = 16
+app.config['BURST_IOU_THRESHOLD'] = 0.3
+app.config['BURST_MIN_HITS'] = 2
+app.config['BURST_CROPS_PER_TRACK'] = 1
+# Matching index: 'exact' scans every enrolled face, 'ivf' is approximate
+# (k-means partitions) for district-scale galleries
+app.config['FACE_INDEX'] = os.environ.get('FACE_INDEX', 'exact')
+app.config['FACE_INDEX_PATH'] = 'face_index.npz'
+app.config['FACE_INDEX_NPROBE'] = 8
+# When a request is scoped to a class/section, retry unmatched faces
+# against the whole school
+app.config['SCOPE_FALLBACK_TO_SCHOOL'] = True
+# Live event feed: how often streams look for events committed by other
+# processes (seconds), and the keepalive interval for idle connections
+app.config['EVENTS_POLL_INTERVAL'] = 2
+app.config['EVENTS_KEEPALIVE'] = 15
+# Frames queued by /api/mark_attendance?async=1: background threads that
+# process them, and how many may wait before requests get 503
+app.config['ATTENDANCE_JOB_WORKERS'] = 2
+app.config['ATTENDANCE_JOB_LIMIT'] = 64
+# Students per /api/students page by default, and the most a client may ask for
+app.config['STUDENTS_PAGE_SIZE'] = 100
+app.config['STUDENTS_PAGE_MAX'] = 1000
+# Memory-mapped gallery snapshot (path prefix) reused across restarts while
+# the roster is unchanged
+app.config['GALLERY_SNAPSHOT_PATH'] = 'face_gallery_dlib'
+# Processes that detect, encode and match frames off the request thread,
+# and how many frames may wait for them before requests are turned away
+# with 503. 0 (the default) runs recognition inline; each worker loads its
+# own models and gallery copy, so only turn them on with RAM to spare. The
+# limit must fit a full batch or burst
+app.config['RECOGNITION_WORKERS'] = int(os.environ.get('RECOGNITION_WORKERS', 0))
+app.config['RECOGNITION_QUEUE_LIMIT'] = int(os.environ.get('RECOGNITION_QUEUE_LIMIT', 32))
 
 db = SQLAlchemy(app)
 
@@ -28,6 +98,10 @@ class Student(db.Model):
     photo_path = db.Column(db.String(200), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_student_class_section', 'class_name', 'section'),
+    )
+    
     def __repr__(self):
         return f'<Student {self.name}>'
 
@@ -41,44 +115,223 @@ class Attendance(db.Model):
     
     student = db.relationship('Student', backref=db.backref('attendance_records', lazy=True))
     
+    # One attendance row per student per day, even with several cameras;
+    # reports filter on date alone
+    __table_args__ = (
+        db.Index('uq_attendance_student_date', 'student_id', 'date', unique=True),
+        db.Index('ix_attendance_date', 'date'),
+    )
+    
     def __repr__(self):
         return f'<Attendance {self.student_id} - {self.date}>'
 
+class DailySummary(db.Model):
+    """Attendance counts per day and class/section, kept current as students
+    are marked and enrolled so dashboards never count the roster"""
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    class_name = db.Column(db.String(20), nullable=False)
+    section = db.Column(db.String(10), nullable=False)
+    present = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('uq_daily_summary_date_class', 'date', 'class_name', 'section', unique=True),
+    )
+    
+    def __repr__(self):
+        return f'<DailySummary {self.date} {self.class_name}-{self.section} {self.present}/{self.total}>'
+
+class RecognitionJob(db.Model):
+    """Frame queued for background attendance marking, and its result"""
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    params = db.Column(db.Text, nullable=False)
+    payload = db.Column(db.LargeBinary, nullable=True)   # the frame; cleared once processed
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.String(200), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    owner = db.Column(db.String(64), nullable=True)      # host:pid of the process running it
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_recognition_job_status', 'status'),
+    )
+    
+    def __repr__(self):
+        return f'<RecognitionJob {self.id} {self.status}>'
+
+class StudentChange(db.Model):
+    """Append-only log of roster changes; the latest id is the gallery version"""
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.String(20), nullable=False)
+    operation = db.Column(db.String(10), nullable=False, default='add')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<StudentChange {self.id} {self.operation} {self.student_id}>'
+
+# Student columns kept alongside the gallery matrix for scoped matching
+GALLERY_COLUMNS = {'class_name': '<U20', 'section': '<U10', 'name': '<U100'}
+# Columns the recognition workers need for scoped matching
+SCOPE_COLUMNS = {'class_name': '<U20', 'section': '<U10'}
+
+def gallery_metadata(student):
+    return {'class_name': student.class_name, 'section': student.section, 'name': student.name}
+
+def roster_signature(engine):
+    """Fingerprint of the enrolled roster; a gallery snapshot is reused only while it matches"""
+    version = db.session.query(db.func.max(StudentChange.id)).scalar() or 0
+    count, last_id = db.session.query(db.func.count(Student.id), db.func.max(Student.id)).filter(
+        Student.face_encoding.isnot(None)
+    ).one()
+    return f'{engine}:{FORMAT_VERSION}:{version}:{count}:{last_id or 0}'
+
+def check_recognition_queue():
+    """Reject a recognition queue limit below the frame caps: every full-size
+    batch or burst would be turned away with 503"""
+    limit = app.config['RECOGNITION_QUEUE_LIMIT'] or app.config['RECOGNITION_WORKERS'] * 4
+    frames = max(app.config['BATCH_MAX_FRAMES'], app.config['BURST_MAX_FRAMES'])
+    if limit < frames:
+        raise ValueError(f'RECOGNITION_QUEUE_LIMIT ({limit}) must be at least BATCH_MAX_FRAMES and '
+                         f'BURST_MAX_FRAMES ({frames})')
+
 class FaceRecognitionSystem:
     def __init__(self):
-        self.known_face_encodings = []
-        self.known_face_names = []
+        if app.config['RECOGNITION_WORKERS'] > 0:
+            check_recognition_queue()
+        self.encoder = make_encoder('dlib', **self.encoder_options())
+        options = self.index_options()
+        index = make_index(options['index'], options['index_path'], **options['index_options'])
+        self.gallery = FaceGallery(dim=self.encoder.dim, index=index, columns=GALLERY_COLUMNS)
+        self.pool = None
+        self.sync_lock = threading.Lock()
         self.load_known_faces()
+        
+        if app.config['RECOGNITION_WORKERS'] > 0:
+            self.pool = RecognitionPool(
+                self.encoder.kind,
+                {'dim': self.encoder.dim, 'metric': self.gallery.metric,
+                 'columns': SCOPE_COLUMNS, **self.index_options()},
+                workers=app.config['RECOGNITION_WORKERS'],
+                max_pending=app.config['RECOGNITION_QUEUE_LIMIT'],
+                encoder_options=self.encoder_options()
+            )
+            self.pool.publish(self.gallery)
+    
+    def encoder_options(self):
+        """make_encoder arguments: the configured detector and encoding cache"""
+        cache = None
+        if app.config['ENCODING_CACHE_SIZE']:
+            cache = {'max_entries': app.config['ENCODING_CACHE_SIZE'],
+                     'directory': app.config['ENCODING_CACHE_DIR'],
+                     'max_disk_entries': app.config['ENCODING_CACHE_DISK_SIZE']}
+        return {'detector': app.config['FACE_DETECTOR'], 'cache': cache, **detector_options()}
+    
+    def index_options(self):
+        """make_index arguments for the configured matching index"""
+        options = {'nprobe': app.config['FACE_INDEX_NPROBE']} if app.config['FACE_INDEX'] == 'ivf' else {}
+        return {'index': app.config['FACE_INDEX'], 'index_path': app.config['FACE_INDEX_PATH'],
+                'index_options': options}
     
     def load_known_faces(self):
-        """Load all student face encodings from database"""
-        students = Student.query.filter(Student.face_encoding.isnot(None)).all()
-        self.known_face_encodings = []
-        self.known_face_names = []
+        """Map the on-disk gallery snapshot, rebuilding it from the database when stale"""
+        snapshot_path = app.config['GALLERY_SNAPSHOT_PATH']
+        signature = roster_signature(self.encoder.kind)
+        if not self.gallery.open_snapshot(snapshot_path, signature):
+            self.load_from_database()
+            try:
+                self.gallery.save_snapshot(snapshot_path, signature)
+            except OSError as e:
+                print(f"Error saving gallery snapshot: {e}")
         
+        # Persist the trained index so the next start (and every worker) skips k-means
+        if getattr(self.gallery.index, 'is_trained', False):
+            self.gallery.index.save(app.config['FACE_INDEX_PATH'])
+        
+        if self.pool:
+            self.pool.publish(self.gallery)
+    
+    def load_from_database(self):
+        """Load all student face encodings from database into the gallery matrix"""
+        rows = db.session.query(
+            Student.student_id, Student.name, Student.class_name, Student.section, Student.face_encoding
+        ).filter(Student.face_encoding.isnot(None)).all()
+        
+        # One frombuffer over every packed encoding instead of a loads per student
+        encodings, valid = unpack_encodings([row.face_encoding for row in rows], self.encoder.kind)
+        if not valid.all():
+            print(f"Skipping {int((~valid).sum())} face encodings not in the packed {self.encoder.kind} format; "
+                  f"convert legacy rows with: python encoding_format.py --engine {self.encoder.kind}")
+        students = [row for row, ok in zip(rows, valid) if ok]
+        
+        metadata = {name: [] for name in GALLERY_COLUMNS}
         for student in students:
-            if student.face_encoding:
-                face_encoding = pickle.loads(student.face_encoding)
-                self.known_face_encodings.append(face_encoding)
-                self.known_face_names.append(student.student_id)
+            for name, value in gallery_metadata(student).items():
+                metadata[name].append(value)
+        
+        version = db.session.query(db.func.max(StudentChange.id)).scalar() or 0
+        self.gallery.load([student.student_id for student in students], encodings,
+                          version=version, metadata=metadata)
     
-    def encode_face_from_image(self, image_data):
-        """Extract face encoding from image data"""
+    def add_student(self, student, version=None):
+        """Add or replace a single student's row in the gallery"""
         try:
-            # Convert base64 to image
-            if isinstance(image_data, str) and image_data.startswith('data:image'):
-                image_data = image_data.split(',')[1]
+            encoding = unpack_encoding(student.face_encoding, self.encoder.kind) if student.face_encoding else None
+        except EncodingFormatError as e:
+            print(f"Error loading encoding of {student.student_id}: {e}")
+            encoding = None
+        
+        if encoding is None:
+            self.gallery.remove(student.student_id, version=version)
+        else:
+            self.gallery.add(student.student_id, encoding, version=version, metadata=gallery_metadata(student))
+    
+    def update_student(self, student, version=None):
+        """Refresh a single student's row after their encoding changed"""
+        self.add_student(student, version=version)
+    
+    def remove_student(self, student_id, version=None):
+        """Drop a single student's row from the gallery"""
+        self.gallery.remove(student_id, version=version)
+    
+    def sync(self):
+        """Apply roster changes logged since this gallery's version"""
+        # Request and job threads sync concurrently; apply each change once, in order
+        with self.sync_lock:
+            changes = StudentChange.query.filter(
+                StudentChange.id > self.gallery.version
+            ).order_by(StudentChange.id).all()
+            if not changes:
+                return
             
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
-            image_array = np.array(image)
+            changed_ids = {change.student_id for change in changes}
+            students = {
+                student.student_id: student
+                for student in Student.query.filter(Student.student_id.in_(changed_ids)).all()
+            }
             
-            # Convert RGB to BGR for OpenCV
-            if len(image_array.shape) == 3:
-                image_array = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
+            for change in changes:
+                student = students.get(change.student_id)
+                if change.operation == 'remove' or student is None:
+                    self.remove_student(change.student_id, version=change.id)
+                else:
+                    self.add_student(student, version=change.id)
             
+            # Broadcast the new rows to the recognition workers
+            if self.pool:
+                self.pool.publish(self.gallery)
+    
+    def encode_faces(self, frame):
+        """Encodings of every face in the frame, computed at full resolution"""
+        return self.encoder.encode_faces(frame)
+    
+    def encode_face_from_image(self, frame):
+        """Extract face encoding from a decoded frame"""
+        try:
             # Find face encodings
-            face_encodings = face_recognition.face_encodings(image_array)
+            face_encodings = self.encode_faces(frame)
             
             if len(face_encodings) > 0:
                 return face_encodings[0]
@@ -88,51 +341,246 @@ class FaceRecognitionSystem:
             print(f"Error encoding face: {e}")
             return None
     
-    def recognize_faces(self, image_data):
-        """Recognize faces in the given image"""
+    def encode_frame(self, frame):
+        """Detect and encode one frame, treating a failure as no faces"""
         try:
-            # Convert base64 to image
-            if isinstance(image_data, str) and image_data.startswith('data:image'):
-                image_data = image_data.split(',')[1]
-            
-            image_bytes = base64.b64decode(image_data)
-            image = Image.open(io.BytesIO(image_bytes))
-            image_array = np.array(image)
-            
-            # Find faces in the image
-            face_locations = face_recognition.face_locations(image_array)
-            face_encodings = face_recognition.face_encodings(image_array, face_locations)
-            
-            recognized_students = []
-            
-            for face_encoding in face_encodings:
-                matches = face_recognition.compare_faces(self.known_face_encodings, face_encoding, tolerance=0.6)
-                face_distances = face_recognition.face_distance(self.known_face_encodings, face_encoding)
+            return self.encode_faces(frame)
+        except Exception as e:
+            print(f"Error encoding frame: {e}")
+            return []
+    
+    def match_encodings(self, face_encodings, class_name=None, section=None):
+        """Best (student_id, distance) per encoding, or None if unmatched.
+        
+        A class/section scope only searches that section's rows; unmatched
+        faces fall back to the whole school when SCOPE_FALLBACK_TO_SCHOOL is set.
+        """
+        return self.gallery.best_matches(face_encodings, tolerance=0.6, class_name=class_name,
+                                         section=section, fallback=app.config['SCOPE_FALLBACK_TO_SCHOOL'])
+    
+    def match_frames(self, frames, class_name=None, section=None):
+        """(face count, matches) for each frame.
+        
+        Frames go to the recognition workers when the pool is enabled (raising
+        PoolBusy if its queue is full); otherwise they are detected and encoded
+        on a thread pool and matched on this thread.
+        """
+        if self.pool:
+            return self.pool.recognize(frames, class_name=class_name, section=section or None, tolerance=0.6,
+                                       fallback=app.config['SCOPE_FALLBACK_TO_SCHOOL'])
+        
+        if len(frames) == 1:
+            frame_encodings = [self.encode_frame(frames[0])]
+        else:
+            frame_encodings = list(frame_executor.map(self.encode_frame, frames))
+        return [
+            (len(face_encodings), self.match_encodings(face_encodings, class_name, section) if len(face_encodings) else [])
+            for face_encodings in frame_encodings
+        ]
+    
+    def match_burst(self, frames, class_name=None, section=None):
+        """(track count, matches) for a burst of frames of one scene.
+        
+        Faces are tracked across the frames and each track is encoded once,
+        from its sharpest crops, so one capture covers students who blinked
+        or turned away in some frames.
+        """
+        if self.pool:
+            return self.pool.recognize_burst(frames, class_name=class_name, section=section or None, tolerance=0.6,
+                                             fallback=app.config['SCOPE_FALLBACK_TO_SCHOOL'], **burst_options())
+        
+        tracks = burst_encodings(self.encoder, frames, **burst_options())
+        if not tracks:
+            return 0, []
+        return len(tracks), self.match_encodings([encoding for encoding, _ in tracks], class_name, section)
+    
+    def describe_matches(self, matches):
+        """Attach student details kept in the gallery's columns to matches"""
+        recognized_students = []
+        for match in matches:
+            if match:
+                student_id, distance = match
+                confidence = 1 - distance
                 
-                if len(face_distances) > 0:
-                    best_match_index = np.argmin(face_distances)
-                    
-                    if matches[best_match_index]:
-                        student_id = self.known_face_names[best_match_index]
-                        confidence = 1 - face_distances[best_match_index]
-                        
-                        student = Student.query.filter_by(student_id=student_id).first()
-                        if student:
-                            recognized_students.append({
-                                'student_id': student_id,
-                                'name': student.name,
-                                'class': student.class_name,
-                                'section': student.section,
-                                'confidence': float(confidence)
-                            })
-            
-            return recognized_students
+                # Details live alongside the encodings, so no database lookup
+                student = self.gallery.metadata(student_id)
+                if student:
+                    recognized_students.append({
+                        'student_id': student_id,
+                        'name': student['name'],
+                        'class': student['class_name'],
+                        'section': student['section'],
+                        'confidence': float(confidence)
+                    })
+        
+        return recognized_students
+    
+    def identify(self, face_encodings, class_name=None, section=None):
+        """Match encodings against the gallery and attach student details"""
+        if len(face_encodings) == 0:
+            return []
+        
+        # Match every detected face against the gallery at once
+        return self.describe_matches(self.match_encodings(face_encodings, class_name, section))
+    
+    def recognize_faces(self, frame, class_name=None, section=None):
+        """Recognize faces in the given frame, optionally scoped to a class/section"""
+        try:
+            _, matches = self.match_frames([frame], class_name, section)[0]
+            return self.describe_matches(matches)
+        except PoolBusy:
+            raise
         except Exception as e:
             print(f"Error recognizing faces: {e}")
             return []
 
-# Initialize face recognition system
-face_system = FaceRecognitionSystem()
+# The engine is built lazily, by the warm-up thread or the first capture
+# request, so starting up and serving pages and reports never waits for it
+face_system = None
+face_system_error = None
+face_system_lock = threading.Lock()
+warm_up_thread = None
+
+def get_face_system():
+    """The face recognition system, initialized on first use"""
+    global face_system, face_system_error
+    if face_system is None:
+        with face_system_lock:
+            if face_system is None:
+                try:
+                    with app.app_context():
+                        face_system = FaceRecognitionSystem()
+                    face_system_error = None
+                except Exception as e:
+                    face_system_error = str(e)
+                    raise
+    return face_system
+
+def warm_up():
+    try:
+        get_face_system()
+    except Exception as e:
+        print(f"Error initializing face recognition: {e}")
+
+def start_warm_up():
+    """Initialize the face recognition system on a background thread"""
+    global warm_up_thread
+    if warm_up_thread is None:
+        warm_up_thread = threading.Thread(target=warm_up, name='face-system-warm-up', daemon=True)
+        warm_up_thread.start()
+
+# Thread pool for per-frame detection and encoding in batch requests when
+# recognition runs inline; OpenCV and dlib release the GIL while they work
+frame_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 2)
+
+# Wakes /api/events streams in this process when attendance or an
+# enrollment is committed
+event_notifier = EventNotifier()
+
+def busy_response(error):
+    """503 telling the camera to retry when the recognition queue is full"""
+    return jsonify({'success': False, 'message': f'{error}, please retry'}), 503, {'Retry-After': '1'}
+
+def detector_options():
+    """FACE_DETECTOR_OPTIONS entry of the selected FACE_DETECTOR"""
+    return app.config['FACE_DETECTOR_OPTIONS'].get(app.config['FACE_DETECTOR'], {})
+
+def burst_options():
+    """Tracking options for tracking.burst_encodings from the app config"""
+    return {
+        'iou_threshold': app.config['BURST_IOU_THRESHOLD'],
+        'min_hits': app.config['BURST_MIN_HITS'],
+        'crops_per_track': app.config['BURST_CROPS_PER_TRACK']
+    }
+
+def merge_recognitions(frame_results):
+    """Merge per-frame recognitions, keeping each student's best confidence"""
+    best = {}
+    for recognized_students in frame_results:
+        for student_data in recognized_students:
+            current = best.get(student_data['student_id'])
+            if current is None or student_data['confidence'] > current['confidence']:
+                best[student_data['student_id']] = student_data
+    return sorted(best.values(), key=lambda student_data: student_data['confidence'], reverse=True)
+
+def save_attendance(recognized_students, attendance_date):
+    """Mark recognized students present with one INSERT ... ON CONFLICT DO
+    NOTHING, so students already marked that date (possibly by another
+    camera at the same moment) are skipped. Returns the newly marked students."""
+    first_match = {}
+    for student_data in recognized_students:
+        first_match.setdefault(student_data['student_id'], student_data)
+    
+    time_in = datetime.utcnow()
+    inserted = insert_new_rows(db.session, Attendance, [
+        {
+            'student_id': student_id,
+            'date': attendance_date,
+            'time_in': time_in,
+            'status': 'Present',
+            'confidence': student_data['confidence']
+        }
+        for student_id, student_data in first_match.items()
+    ], conflict_columns=['student_id', 'date'], returning='student_id')
+    marked = [student_data for student_id, student_data in first_match.items() if student_id in inserted]
+    record_presences(db.session, Student, DailySummary, attendance_date,
+                     [(student_data['class'], student_data['section']) for student_data in marked])
+    db.session.commit()
+    if marked:
+        event_notifier.notify()
+    
+    return marked
+
+@app.before_request
+def ensure_warm_up():
+    # Under a WSGI server the first request of any kind starts the warm-up
+    start_warm_up()
+
+def mark_frame(image_bytes, class_name=None, section=None, attendance_date=None):
+    """Recognize the students in one frame and mark them present; returns
+    the /api/mark_attendance response body"""
+    face_system = get_face_system()
+    
+    # Pick up students enrolled through other worker processes
+    face_system.sync()
+    
+    # Recognize faces in the image
+    frame = Frame(image_bytes, max_side=app.config['DETECT_MAX_SIDE'])
+    recognized_students = face_system.recognize_faces(
+        frame,
+        class_name=class_name,
+        section=section
+    )
+    
+    if not recognized_students:
+        return {'success': False, 'message': 'No students recognized'}
+    
+    marked_students = save_attendance(recognized_students, attendance_date or date.today())
+    
+    return {
+        'success': True,
+        'message': f'Attendance marked for {len(marked_students)} students',
+        'students': marked_students
+    }
+
+def run_attendance_job(image_bytes, params):
+    return mark_frame(image_bytes, params.get('class_name'), params.get('section'),
+                      datetime.strptime(params['date'], '%Y-%m-%d').date())
+
+attendance_jobs = JobQueue(
+    app, db, RecognitionJob, run_attendance_job,
+    workers=app.config['ATTENDANCE_JOB_WORKERS'],
+    max_queued=app.config['ATTENDANCE_JOB_LIMIT'],
+    retry_on=(PoolBusy,),
+    notifier=event_notifier
+)
+
+# Resume jobs persisted by an earlier run. Under a WSGI server this waits
+# for the first request, when the schema exists; start() is a no-op once it
+# has succeeded
+@app.before_request
+def resume_attendance_jobs():
+    attendance_jobs.start()
 
 @app.route('/')
 def index():
@@ -148,13 +596,21 @@ def attendance():
 
 @app.route('/reports')
 def reports():
-    students = Student.query.all()
-    return render_template('reports.html', students=students)
+    return render_template('reports.html')
+
+@app.route('/api/ready')
+def ready():
+    """Readiness probe: 200 once face recognition is initialized, 503 until then"""
+    if face_system is None:
+        return jsonify({'ready': False, 'error': face_system_error}), 503
+    return jsonify({'ready': True, 'students': len(face_system.gallery)})
 
 @app.route('/api/register_student', methods=['POST'])
 def register_student():
     try:
-        data = request.get_json()
+        face_system = get_face_system()
+        data = request_data(request)
+        photo_bytes = request_image_bytes(request, 'photo', data)
         
         # Check if student already exists
         existing_student = Student.query.filter_by(student_id=data['student_id']).first()
@@ -170,33 +626,31 @@ def register_student():
         )
         
         # Process face image if provided
-        if 'photo' in data and data['photo']:
-            face_encoding = face_system.encode_face_from_image(data['photo'])
+        if photo_bytes:
+            # Decode once; the same frame feeds encoding and the saved photo
+            frame = Frame(photo_bytes, max_side=app.config['DETECT_MAX_SIDE'])
+            face_encoding = face_system.encode_face_from_image(frame)
             if face_encoding is not None:
-                student.face_encoding = pickle.dumps(face_encoding)
+                student.face_encoding = pack_encoding(face_encoding, face_system.encoder.kind)
                 
                 # Save photo
                 os.makedirs('static/photos', exist_ok=True)
                 photo_filename = f"{data['student_id']}.jpg"
                 photo_path = os.path.join('static/photos', photo_filename)
                 
-                # Convert base64 to image and save
-                image_data = data['photo']
-                if image_data.startswith('data:image'):
-                    image_data = image_data.split(',')[1]
-                
-                image_bytes = base64.b64decode(image_data)
-                image = Image.open(io.BytesIO(image_bytes))
-                image.save(photo_path)
+                frame.save(photo_path)
                 student.photo_path = photo_path
             else:
                 return jsonify({'success': False, 'message': 'No face detected in the image'})
         
         db.session.add(student)
+        db.session.add(StudentChange(student_id=student.student_id, operation='add'))
+        record_enrollment(db.session, Student, DailySummary, date.today(), student.class_name, student.section)
         db.session.commit()
+        event_notifier.notify()
         
-        # Reload known faces
-        face_system.load_known_faces()
+        # Apply only the new row (and anything other workers logged) to the gallery
+        face_system.sync()
         
         return jsonify({'success': True, 'message': 'Student registered successfully'})
     
@@ -206,49 +660,127 @@ def register_student():
 @app.route('/api/mark_attendance', methods=['POST'])
 def mark_attendance():
     try:
-        data = request.get_json()
+        data = request_data(request)
+        image_bytes = request_image_bytes(request, 'image', data)
         
-        if 'image' not in data:
+        if not image_bytes:
             return jsonify({'success': False, 'message': 'No image provided'})
         
-        # Recognize faces in the image
-        recognized_students = face_system.recognize_faces(data['image'])
+        # Async mode: queue the frame and answer at once with a job to poll
+        if request_flag(request, 'async', data):
+            job_id = attendance_jobs.submit(image_bytes, {
+                'class_name': data.get('class_name'),
+                'section': data.get('section'),
+                'date': str(date.today())
+            })
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status_url': url_for('attendance_job', job_id=job_id),
+                'events_url': url_for('attendance_job_events', job_id=job_id)
+            }), 202
         
-        if not recognized_students:
-            return jsonify({'success': False, 'message': 'No students recognized'})
+        return jsonify(mark_frame(image_bytes, data.get('class_name'), data.get('section')))
+    
+    except (PoolBusy, JobQueueFull) as e:
+        return busy_response(e)
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
+@app.route('/api/jobs/<job_id>')
+def attendance_job(job_id):
+    """Status, and once done the result, of an async attendance job"""
+    attendance_jobs.start()
+    job = attendance_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Unknown job'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/jobs/<job_id>/events')
+def attendance_job_events(job_id):
+    """Server-Sent Events for an async attendance job until it finishes"""
+    attendance_jobs.start()
+    stream = job_event_stream(
+        attendance_jobs, job_id, event_notifier,
+        poll_interval=app.config['EVENTS_POLL_INTERVAL'],
+        keepalive=app.config['EVENTS_KEEPALIVE']
+    )
+    return Response(
+        stream_with_context(stream),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/mark_attendance_batch', methods=['POST'])
+def mark_attendance_batch():
+    try:
+        face_system = get_face_system()
+        data = request_data(request)
+        images = request_image_list(request, 'images', data)
         
-        marked_students = []
-        today = date.today()
+        if not images:
+            return jsonify({'success': False, 'message': 'No images provided'})
+        if len(images) > app.config['BATCH_MAX_FRAMES']:
+            return jsonify({'success': False, 'message': f"At most {app.config['BATCH_MAX_FRAMES']} frames per batch"})
         
-        for student_data in recognized_students:
-            student_id = student_data['student_id']
-            
-            # Check if attendance already marked today
-            existing_attendance = Attendance.query.filter_by(
-                student_id=student_id,
-                date=today
-            ).first()
-            
-            if not existing_attendance:
-                # Mark attendance
-                attendance = Attendance(
-                    student_id=student_id,
-                    date=today,
-                    time_in=datetime.utcnow(),
-                    status='Present',
-                    confidence=student_data['confidence']
-                )
-                db.session.add(attendance)
-                marked_students.append(student_data)
+        # Pick up students enrolled through other worker processes
+        face_system.sync()
         
-        db.session.commit()
+        # Detect, encode and match all frames in parallel
+        frames = [Frame(image_bytes, max_side=app.config['DETECT_MAX_SIDE']) for image_bytes in images]
+        frame_matches = face_system.match_frames(frames, class_name=data.get('class_name'), section=data.get('section'))
+        frame_results = [face_system.describe_matches(matches) for _, matches in frame_matches]
+        
+        recognized_students = merge_recognitions(frame_results)
+        marked_students = save_attendance(recognized_students, date.today()) if recognized_students else []
         
         return jsonify({
-            'success': True,
-            'message': f'Attendance marked for {len(marked_students)} students',
+            'success': bool(recognized_students),
+            'message': f'Attendance marked for {len(marked_students)} students from {len(frames)} frames',
+            'frames': [
+                {'frame': index, 'faces': face_count, 'students': students}
+                for index, ((face_count, _), students) in enumerate(zip(frame_matches, frame_results))
+            ],
+            'recognized': recognized_students,
             'students': marked_students
         })
     
+    except PoolBusy as e:
+        return busy_response(e)
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
+@app.route('/api/mark_attendance_burst', methods=['POST'])
+def mark_attendance_burst():
+    """Mark attendance from a short burst of frames of the same scene"""
+    try:
+        face_system = get_face_system()
+        data = request_data(request)
+        images = request_image_list(request, 'frames', data)
+        
+        if not images:
+            return jsonify({'success': False, 'message': 'No frames provided'})
+        if len(images) > app.config['BURST_MAX_FRAMES']:
+            return jsonify({'success': False, 'message': f"At most {app.config['BURST_MAX_FRAMES']} frames per burst"})
+        
+        # Pick up students enrolled through other worker processes
+        face_system.sync()
+        
+        frames = [Frame(image_bytes, max_side=app.config['DETECT_MAX_SIDE']) for image_bytes in images]
+        track_count, matches = face_system.match_burst(frames, class_name=data.get('class_name'), section=data.get('section'))
+        recognized_students = merge_recognitions([face_system.describe_matches(matches)])
+        marked_students = save_attendance(recognized_students, date.today()) if recognized_students else []
+        
+        return jsonify({
+            'success': bool(recognized_students),
+            'message': f'Attendance marked for {len(marked_students)} students ({track_count} faces tracked over {len(frames)} frames)',
+            'tracks': track_count,
+            'recognized': recognized_students,
+            'students': marked_students
+        })
+    
+    except PoolBusy as e:
+        return busy_response(e)
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
 
@@ -283,22 +815,123 @@ def attendance_report():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
 
+@app.route('/api/attendance_summary')
+def attendance_summary():
+    """Present/absent/total counts for a day, read from the daily summary"""
+    try:
+        date_str = request.args.get('date')
+        summary_date = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else date.today()
+        summary = day_summary(
+            db.session, Student, DailySummary, summary_date,
+            class_name=request.args.get('class_name'),
+            section=request.args.get('section')
+        )
+        return jsonify({'success': True, **summary})
+    
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
+@app.route('/api/attendance_range')
+def attendance_range():
+    """Aggregated attendance over a date range, optionally for one class/section"""
+    try:
+        start, end = parse_date_range(request.args)
+        report = attendance_range_report(
+            db.session, Student, Attendance, start, end,
+            class_name=request.args.get('class_name'),
+            section=request.args.get('section'),
+            chronic_threshold=float(request.args.get('chronic', 0.1))
+        )
+        return jsonify({'success': True, **report})
+    
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
+@app.route('/api/attendance_export')
+def attendance_export():
+    """Stream attendance records for a date range as CSV or NDJSON"""
+    try:
+        start, end = parse_date_range(request.args)
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'success': False, 'message': f'Unknown export format: {export_format}'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+    
+    encode, mimetype = EXPORT_FORMATS[export_format]
+    rows = export_rows(
+        db.session, Student, Attendance, start, end,
+        class_name=request.args.get('class_name'),
+        section=request.args.get('section'),
+        include_absent=request.args.get('include_absent') in ('1', 'true')
+    )
+    filename = f'attendance_{start}_{end}.{export_format}'
+    return Response(
+        stream_with_context(encode(rows)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.route('/api/events')
+def event_feed():
+    """Server-Sent Events of attendance marks and enrollments, optionally
+    for one ?class_name=&section=; resumes after Last-Event-ID"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        cursor = parse_event_id(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({'success': False, 'message': f'Invalid event id: {last_event_id}'})
+    
+    stream = event_stream(
+        db.session, Student, Attendance, StudentChange, event_notifier, cursor,
+        class_name=request.args.get('class_name'),
+        section=request.args.get('section'),
+        poll_interval=app.config['EVENTS_POLL_INTERVAL'],
+        keepalive=app.config['EVENTS_KEEPALIVE']
+    )
+    return Response(
+        stream_with_context(stream),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/students')
 def get_students():
-    students = Student.query.all()
-    students_data = []
-    for student in students:
-        students_data.append({
-            'student_id': student.student_id,
-            'name': student.name,
-            'class': student.class_name,
-            'section': student.section,
-            'photo_path': student.photo_path,
-            'created_at': student.created_at.strftime('%Y-%m-%d %H:%M:%S')
-        })
-    return jsonify({'success': True, 'students': students_data})
+    """A page of the roster: ?class_name=&section=&fields=a,b&limit=&cursor=
+
+    The ETag follows the roster version, so clients revalidating an
+    unchanged roster get a 304 without any rows being read.
+    """
+    try:
+        version = roster_version(db.session, Student, StudentChange)
+        etag = f'{version}-{zlib.crc32(request.query_string):08x}'
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            fields = request.args.get('fields')
+            limit = request.args.get('limit', app.config['STUDENTS_PAGE_SIZE'], type=int)
+            students, next_cursor = student_page(
+                db.session, Student,
+                fields=fields.split(',') if fields else None,
+                class_name=request.args.get('class_name'),
+                section=request.args.get('section'),
+                after=request.args.get('cursor', type=int),
+                limit=max(1, min(limit, app.config['STUDENTS_PAGE_MAX']))
+            )
+            response = jsonify({'success': True, 'students': students, 'next_cursor': next_cursor})
+        response.set_etag(etag, weak=True)
+        # Cache, but revalidate every time
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
 
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        migrate(db.engine)
+    # Warm up in the reloader's serving process, not the one watching files
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_warm_up()
+        attendance_jobs.start()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -1,17 +1,55 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
 import numpy as np
 import os
+import zlib
 from datetime import datetime, date
-import base64
-import io
-import pickle
+from concurrent.futures import ThreadPoolExecutor
 import random
 
+from daily_summary import day_summary, record_enrollment, record_presences
+from database import insert_new_rows, migrate, sqlite_engine_options
+from encoding_format import pack_encoding, unpack_encoding
+from events import EventNotifier, event_stream, parse_event_id
+from image_io import Frame, request_data, request_flag, request_image_bytes, request_image_list
+from jobs import JobQueue, JobQueueFull, job_event_stream
+from reports import (
+    EXPORT_FORMATS, attendance_range_report, export_rows, parse_date_range, roster_version, student_page
+)
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'rural-school-attendance-system-2024'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///attendance.db'
+# Database URL; DATABASE_URL points a run (e.g. benchmarks.py) at another database
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///attendance.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pooled connections (WAL and pragmas are set per connection in database.py)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = sqlite_engine_options()
+# Longest side (pixels) frames are downscaled to before face detection;
+# None detects on the full-resolution frame
+app.config['DETECT_MAX_SIDE'] = 640
+# Most frames accepted by /api/mark_attendance_batch
+app.config['BATCH_MAX_FRAMES'] = 10
+# Burst capture (/api/mark_attendance_burst): most frames per burst, the
+# overlap (IoU) that links face boxes of consecutive frames into one track,
+# the frames a track must appear in, and the sharpest crops encoded per track
+app.config['BURST_MAX_FRAMES'] = 16
+app.config['BURST_IOU_THRESHOLD'] = 0.3
+app.config['BURST_MIN_HITS'] = 2
+app.config['BURST_CROPS_PER_TRACK'] = 1
+# When a request is scoped to a class/section, retry unmatched faces
+# against the whole school
+app.config['SCOPE_FALLBACK_TO_SCHOOL'] = True
+# Live event feed: how often streams look for events committed by other
+# processes (seconds), and the keepalive interval for idle connections
+app.config['EVENTS_POLL_INTERVAL'] = 2
+app.config['EVENTS_KEEPALIVE'] = 15
+# Frames queued by /api/mark_attendance?async=1: background threads that
+# process them, and how many may wait before requests get 503
+app.config['ATTENDANCE_JOB_WORKERS'] = 2
+app.config['ATTENDANCE_JOB_LIMIT'] = 64
+# Students per /api/students page by default, and the most a client may ask for
+app.config['STUDENTS_PAGE_SIZE'] = 100
+app.config['STUDENTS_PAGE_MAX'] = 1000
 
 db = SQLAlchemy(app)
 
@@ -26,6 +64,10 @@ class Student(db.Model):
     photo_path = db.Column(db.String(200), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        db.Index('ix_student_class_section', 'class_name', 'section'),
+    )
+    
     def __repr__(self):
         return f'<Student {self.name}>'
 
@@ -39,13 +81,68 @@ class Attendance(db.Model):
     
     student = db.relationship('Student', backref=db.backref('attendance_records', lazy=True))
     
+    # One attendance row per student per day, even with several cameras;
+    # reports filter on date alone
+    __table_args__ = (
+        db.Index('uq_attendance_student_date', 'student_id', 'date', unique=True),
+        db.Index('ix_attendance_date', 'date'),
+    )
+    
     def __repr__(self):
         return f'<Attendance {self.student_id} - {self.date}>'
 
+class DailySummary(db.Model):
+    """Attendance counts per day and class/section, kept current as students
+    are marked and enrolled so dashboards never count the roster"""
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False)
+    class_name = db.Column(db.String(20), nullable=False)
+    section = db.Column(db.String(10), nullable=False)
+    present = db.Column(db.Integer, nullable=False, default=0)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        db.Index('uq_daily_summary_date_class', 'date', 'class_name', 'section', unique=True),
+    )
+    
+    def __repr__(self):
+        return f'<DailySummary {self.date} {self.class_name}-{self.section} {self.present}/{self.total}>'
+
+class RecognitionJob(db.Model):
+    """Frame queued for background attendance marking, and its result"""
+    id = db.Column(db.String(32), primary_key=True)
+    status = db.Column(db.String(10), nullable=False, default='queued')
+    params = db.Column(db.Text, nullable=False)
+    payload = db.Column(db.LargeBinary, nullable=True)   # the frame; cleared once processed
+    result = db.Column(db.Text, nullable=True)
+    error = db.Column(db.String(200), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    owner = db.Column(db.String(64), nullable=True)      # host:pid of the process running it
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (
+        db.Index('ix_recognition_job_status', 'status'),
+    )
+    
+    def __repr__(self):
+        return f'<RecognitionJob {self.id} {self.status}>'
+
+class StudentChange(db.Model):
+    """Append-only log of roster changes; the latest id is the gallery version"""
+    id = db.Column(db.Integer, primary_key=True)
+    student_id = db.Column(db.String(20), nullable=False)
+    operation = db.Column(db.String(10), nullable=False, default='add')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<StudentChange {self.id} {self.operation} {self.student_id}>'
+
 class DemoFaceRecognitionSystem:
     """Demo version that simulates face recognition for testing purposes"""
     def __init__(self):
         self.known_faces = {}
+        self.version = 0
         self.load_known_faces()
     
     def load_known_faces(self):
@@ -56,7 +153,7 @@ class DemoFaceRecognitionSystem:
         for student in students:
             if student.face_encoding:
                 try:
-                    face_data = pickle.loads(student.face_encoding)
+                    face_data = unpack_encoding(student.face_encoding)
                     self.known_faces[student.student_id] = {
                         'face_data': face_data,
                         'name': student.name,
@@ -65,8 +162,66 @@ class DemoFaceRecognitionSystem:
                     }
                 except:
                     continue
+        
+        self.version = db.session.query(db.func.max(StudentChange.id)).scalar() or 0
+    
+    def add_student(self, student, version=None):
+        """Add or replace a single student's entry in known faces"""
+        if student.face_encoding:
+            try:
+                self.known_faces[student.student_id] = {
+                    'face_data': unpack_encoding(student.face_encoding),
+                    'name': student.name,
+                    'class': student.class_name,
+                    'section': student.section
+                }
+            except:
+                self.known_faces.pop(student.student_id, None)
+        else:
+            self.known_faces.pop(student.student_id, None)
+        self.version = self.version + 1 if version is None else version
+    
+    def update_student(self, student, version=None):
+        """Refresh a single student's entry after their encoding changed"""
+        self.add_student(student, version=version)
+    
+    def remove_student(self, student_id, version=None):
+        """Drop a single student's entry from known faces"""
+        self.known_faces.pop(student_id, None)
+        self.version = self.version + 1 if version is None else version
     
-    def encode_face_from_image(self, image_data):
+    def scoped_faces(self, class_name=None, section=None):
+        """Known faces restricted to one class (and optionally one section)"""
+        if not class_name:
+            return self.known_faces
+        return {
+            student_id: student_data
+            for student_id, student_data in self.known_faces.items()
+            if student_data['class'] == class_name and (not section or student_data['section'] == section)
+        }
+    
+    def sync(self):
+        """Apply roster changes logged since this engine's version"""
+        changes = StudentChange.query.filter(
+            StudentChange.id > self.version
+        ).order_by(StudentChange.id).all()
+        if not changes:
+            return
+        
+        changed_ids = {change.student_id for change in changes}
+        students = {
+            student.student_id: student
+            for student in Student.query.filter(Student.student_id.in_(changed_ids)).all()
+        }
+        
+        for change in changes:
+            student = students.get(change.student_id)
+            if change.operation == 'remove' or student is None:
+                self.remove_student(change.student_id, version=change.id)
+            else:
+                self.add_student(student, version=change.id)
+    
+    def encode_face_from_image(self, frame):
         """Demo: Generate a random face encoding"""
         try:
             # In a real system, this would extract actual face features
@@ -78,31 +233,42 @@ class DemoFaceRecognitionSystem:
             print(f"Error encoding face: {e}")
             return None
     
-    def recognize_faces(self, image_data):
+    def encode_faces(self, frame):
+        """Demo: No real detection, so there are no encodings to compute"""
+        return []
+    
+    def identify(self, face_encodings, class_name=None, section=None):
         """Demo: Simulate face recognition by randomly selecting registered students"""
-        try:
-            if not self.known_faces:
-                return []
-            
-            # For demo purposes, randomly select 1-3 students from registered students
-            # In a real system, this would use actual face recognition
-            num_detected = random.randint(1, min(3, len(self.known_faces)))
-            selected_students = random.sample(list(self.known_faces.keys()), num_detected)
-            
-            recognized_students = []
-            for student_id in selected_students:
-                student_data = self.known_faces[student_id]
-                confidence = random.uniform(0.7, 0.95)  # Random confidence between 70-95%
-                
-                recognized_students.append({
-                    'student_id': student_id,
-                    'name': student_data['name'],
-                    'class': student_data['class'],
-                    'section': student_data['section'],
-                    'confidence': float(confidence)
-                })
+        candidates = self.scoped_faces(class_name, section)
+        if not candidates and app.config['SCOPE_FALLBACK_TO_SCHOOL']:
+            candidates = self.known_faces
+        if not candidates:
+            return []
+        
+        # For demo purposes, randomly select 1-3 students from registered students
+        # In a real system, this would use actual face recognition
+        num_detected = random.randint(1, min(3, len(candidates)))
+        selected_students = random.sample(list(candidates.keys()), num_detected)
+        
+        recognized_students = []
+        for student_id in selected_students:
+            student_data = self.known_faces[student_id]
+            confidence = random.uniform(0.7, 0.95)  # Random confidence between 70-95%
             
-            return recognized_students
+            recognized_students.append({
+                'student_id': student_id,
+                'name': student_data['name'],
+                'class': student_data['class'],
+                'section': student_data['section'],
+                'confidence': float(confidence)
+            })
+        
+        return recognized_students
+    
+    def recognize_faces(self, frame, class_name=None, section=None):
+        """Demo: Simulate face recognition by randomly selecting registered students"""
+        try:
+            return self.identify(self.encode_faces(frame), class_name, section)
             
         except Exception as e:
             print(f"Error recognizing faces: {e}")
@@ -111,6 +277,118 @@ class DemoFaceRecognitionSystem:
 # Initialize demo face recognition system (will be done after app context is created)
 face_system = None
 
+def get_face_system():
+    """The demo face recognition system, initialized on first use"""
+    global face_system
+    if face_system is None:
+        face_system = DemoFaceRecognitionSystem()
+    return face_system
+
+# Thread pool for per-frame encoding in batch requests, kept so the batch
+# path mirrors the real versions. Demo frames are not decoded or encoded,
+# so two threads are plenty
+frame_executor = ThreadPoolExecutor(max_workers=2)
+
+# Wakes /api/events streams in this process when attendance or an
+# enrollment is committed
+event_notifier = EventNotifier()
+
+def busy_response(error):
+    """503 telling the camera to retry when the job queue is full"""
+    return jsonify({'success': False, 'message': f'{error}, please retry'}), 503, {'Retry-After': '1'}
+
+def encode_frame(frame):
+    """Detect and encode one frame, treating a failure as no faces"""
+    try:
+        return face_system.encode_faces(frame)
+    except Exception as e:
+        print(f"Error encoding frame: {e}")
+        return []
+
+def merge_recognitions(frame_results):
+    """Merge per-frame recognitions, keeping each student's best confidence"""
+    best = {}
+    for recognized_students in frame_results:
+        for student_data in recognized_students:
+            current = best.get(student_data['student_id'])
+            if current is None or student_data['confidence'] > current['confidence']:
+                best[student_data['student_id']] = student_data
+    return sorted(best.values(), key=lambda student_data: student_data['confidence'], reverse=True)
+
+def save_attendance(recognized_students, attendance_date):
+    """Mark recognized students present with one INSERT ... ON CONFLICT DO
+    NOTHING, so students already marked that date (possibly by another
+    camera at the same moment) are skipped. Returns the newly marked students."""
+    first_match = {}
+    for student_data in recognized_students:
+        first_match.setdefault(student_data['student_id'], student_data)
+    
+    time_in = datetime.utcnow()
+    inserted = insert_new_rows(db.session, Attendance, [
+        {
+            'student_id': student_id,
+            'date': attendance_date,
+            'time_in': time_in,
+            'status': 'Present',
+            'confidence': student_data['confidence']
+        }
+        for student_id, student_data in first_match.items()
+    ], conflict_columns=['student_id', 'date'], returning='student_id')
+    marked = [student_data for student_id, student_data in first_match.items() if student_id in inserted]
+    record_presences(db.session, Student, DailySummary, attendance_date,
+                     [(student_data['class'], student_data['section']) for student_data in marked])
+    db.session.commit()
+    if marked:
+        event_notifier.notify()
+    
+    return marked
+
+def mark_frame(image_bytes, class_name=None, section=None, attendance_date=None):
+    """Recognize the students in one frame and mark them present; returns
+    the /api/mark_attendance response body"""
+    face_system = get_face_system()
+    
+    # Pick up students enrolled through other worker processes
+    face_system.sync()
+    
+    # Recognize faces in the image (demo mode)
+    frame = Frame(image_bytes, max_side=app.config['DETECT_MAX_SIDE'])
+    recognized_students = face_system.recognize_faces(
+        frame,
+        class_name=class_name,
+        section=section
+    )
+    
+    if not recognized_students:
+        return {'success': False, 'message': 'No students recognized. Please register students first. (Demo mode)'}
+    
+    marked_students = save_attendance(recognized_students, attendance_date or date.today())
+    
+    message = f'Attendance marked for {len(marked_students)} students (Demo mode - simulated recognition)'
+    return {
+        'success': True,
+        'message': message,
+        'students': marked_students
+    }
+
+def run_attendance_job(image_bytes, params):
+    return mark_frame(image_bytes, params.get('class_name'), params.get('section'),
+                      datetime.strptime(params['date'], '%Y-%m-%d').date())
+
+attendance_jobs = JobQueue(
+    app, db, RecognitionJob, run_attendance_job,
+    workers=app.config['ATTENDANCE_JOB_WORKERS'],
+    max_queued=app.config['ATTENDANCE_JOB_LIMIT'],
+    notifier=event_notifier
+)
+
+# Resume jobs persisted by an earlier run. Under a WSGI server this waits
+# for the first request, when the schema exists; start() is a no-op once it
+# has succeeded
+@app.before_request
+def resume_attendance_jobs():
+    attendance_jobs.start()
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -125,16 +403,19 @@ def attendance():
 
 @app.route('/reports')
 def reports():
-    students = Student.query.all()
-    return render_template('reports.html', students=students)
+    return render_template('reports.html')
+
+@app.route('/api/ready')
+def ready():
+    """Readiness probe; the demo system has nothing heavy to load"""
+    return jsonify({'ready': True, 'students': len(face_system.known_faces) if face_system else None})
 
 @app.route('/api/register_student', methods=['POST'])
 def register_student():
-    global face_system
-    if face_system is None:
-        face_system = DemoFaceRecognitionSystem()
     try:
-        data = request.get_json()
+        face_system = get_face_system()
+        data = request_data(request)
+        photo_bytes = request_image_bytes(request, 'photo', data)
         
         # Check if student already exists
         existing_student = Student.query.filter_by(student_id=data['student_id']).first()
@@ -150,38 +431,32 @@ def register_student():
         )
         
         # Process face image if provided
-        if 'photo' in data and data['photo']:
-            face_encoding = face_system.encode_face_from_image(data['photo'])
+        if photo_bytes:
+            # Decode once; the same frame feeds encoding and the saved photo
+            frame = Frame(photo_bytes, max_side=app.config['DETECT_MAX_SIDE'])
+            face_encoding = face_system.encode_face_from_image(frame)
             if face_encoding is not None:
-                student.face_encoding = pickle.dumps(face_encoding)
+                student.face_encoding = pack_encoding(face_encoding, 'demo')
                 
                 # Save photo
                 os.makedirs('static/photos', exist_ok=True)
                 photo_filename = f"{data['student_id']}.jpg"
                 photo_path = os.path.join('static/photos', photo_filename)
                 
-                # Convert base64 to image and save
-                try:
-                    from PIL import Image
-                    image_data_clean = data['photo']
-                    if image_data_clean.startswith('data:image'):
-                        image_data_clean = image_data_clean.split(',')[1]
-                    
-                    image_bytes = base64.b64decode(image_data_clean)
-                    image = Image.open(io.BytesIO(image_bytes))
-                    image.save(photo_path)
-                    student.photo_path = photo_path
-                except ImportError:
-                    # If PIL is not available, just store the encoding
-                    pass
+                # Uploaded JPEG bytes are written as-is, no decode needed
+                frame.save(photo_path)
+                student.photo_path = photo_path
             else:
                 return jsonify({'success': False, 'message': 'Error processing image. Please try again with good lighting.'})
         
         db.session.add(student)
+        db.session.add(StudentChange(student_id=student.student_id, operation='add'))
+        record_enrollment(db.session, Student, DailySummary, date.today(), student.class_name, student.section)
         db.session.commit()
+        event_notifier.notify()
         
-        # Reload known faces
-        face_system.load_known_faces()
+        # Apply only the new row (and anything other workers logged) to the gallery
+        face_system.sync()
         
         return jsonify({'success': True, 'message': 'Student registered successfully! (Demo mode - face recognition simulated)'})
     
@@ -190,51 +465,129 @@ def register_student():
 
 @app.route('/api/mark_attendance', methods=['POST'])
 def mark_attendance():
-    global face_system
-    if face_system is None:
-        face_system = DemoFaceRecognitionSystem()
     try:
-        data = request.get_json()
+        data = request_data(request)
+        image_bytes = request_image_bytes(request, 'image', data)
         
-        if 'image' not in data:
+        if not image_bytes:
             return jsonify({'success': False, 'message': 'No image provided'})
         
-        # Recognize faces in the image (demo mode)
-        recognized_students = face_system.recognize_faces(data['image'])
+        # Async mode: queue the frame and answer at once with a job to poll
+        if request_flag(request, 'async', data):
+            job_id = attendance_jobs.submit(image_bytes, {
+                'class_name': data.get('class_name'),
+                'section': data.get('section'),
+                'date': str(date.today())
+            })
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status_url': url_for('attendance_job', job_id=job_id),
+                'events_url': url_for('attendance_job_events', job_id=job_id)
+            }), 202
         
-        if not recognized_students:
-            return jsonify({'success': False, 'message': 'No students recognized. Please register students first. (Demo mode)'})
+        return jsonify(mark_frame(image_bytes, data.get('class_name'), data.get('section')))
+    
+    except JobQueueFull as e:
+        return busy_response(e)
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
+@app.route('/api/jobs/<job_id>')
+def attendance_job(job_id):
+    """Status, and once done the result, of an async attendance job"""
+    attendance_jobs.start()
+    job = attendance_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'message': 'Unknown job'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/jobs/<job_id>/events')
+def attendance_job_events(job_id):
+    """Server-Sent Events for an async attendance job until it finishes"""
+    attendance_jobs.start()
+    stream = job_event_stream(
+        attendance_jobs, job_id, event_notifier,
+        poll_interval=app.config['EVENTS_POLL_INTERVAL'],
+        keepalive=app.config['EVENTS_KEEPALIVE']
+    )
+    return Response(
+        stream_with_context(stream),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/api/mark_attendance_batch', methods=['POST'])
+def mark_attendance_batch():
+    try:
+        face_system = get_face_system()
+        data = request_data(request)
+        images = request_image_list(request, 'images', data)
         
-        marked_students = []
-        today = date.today()
+        if not images:
+            return jsonify({'success': False, 'message': 'No images provided'})
+        if len(images) > app.config['BATCH_MAX_FRAMES']:
+            return jsonify({'success': False, 'message': f"At most {app.config['BATCH_MAX_FRAMES']} frames per batch"})
         
-        for student_data in recognized_students:
-            student_id = student_data['student_id']
-            
-            # Check if attendance already marked today
-            existing_attendance = Attendance.query.filter_by(
-                student_id=student_id,
-                date=today
-            ).first()
-            
-            if not existing_attendance:
-                # Mark attendance
-                attendance = Attendance(
-                    student_id=student_id,
-                    date=today,
-                    time_in=datetime.utcnow(),
-                    status='Present',
-                    confidence=student_data['confidence']
-                )
-                db.session.add(attendance)
-                marked_students.append(student_data)
+        # Pick up students enrolled through other worker processes
+        face_system.sync()
         
-        db.session.commit()
+        # Detect and encode all frames in parallel, then match on this thread
+        frames = [Frame(image_bytes, max_side=app.config['DETECT_MAX_SIDE']) for image_bytes in images]
+        frame_encodings = list(frame_executor.map(encode_frame, frames))
+        frame_results = [
+            face_system.identify(face_encodings, class_name=data.get('class_name'), section=data.get('section'))
+            for face_encodings in frame_encodings
+        ]
+        
+        recognized_students = merge_recognitions(frame_results)
+        marked_students = save_attendance(recognized_students, date.today()) if recognized_students else []
+        
+        return jsonify({
+            'success': bool(recognized_students),
+            'message': f'Attendance marked for {len(marked_students)} students from {len(frames)} frames (Demo mode - simulated recognition)',
+            'frames': [
+                {'frame': index, 'faces': len(face_encodings), 'students': students}
+                for index, (face_encodings, students) in enumerate(zip(frame_encodings, frame_results))
+            ],
+            'recognized': recognized_students,
+            'students': marked_students
+        })
+    
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
+@app.route('/api/mark_attendance_burst', methods=['POST'])
+def mark_attendance_burst():
+    """Mark attendance from a short burst of frames of the same scene"""
+    try:
+        face_system = get_face_system()
+        data = request_data(request)
+        images = request_image_list(request, 'frames', data)
+        
+        if not images:
+            return jsonify({'success': False, 'message': 'No frames provided'})
+        if len(images) > app.config['BURST_MAX_FRAMES']:
+            return jsonify({'success': False, 'message': f"At most {app.config['BURST_MAX_FRAMES']} frames per burst"})
+        
+        # Pick up students enrolled through other worker processes
+        face_system.sync()
+        
+        # Demo mode has no detector to track with: simulate one recognition
+        # for the whole burst from its middle frame
+        frame = Frame(images[len(images) // 2], max_side=app.config['DETECT_MAX_SIDE'])
+        recognized_students = face_system.recognize_faces(
+            frame,
+            class_name=data.get('class_name'),
+            section=data.get('section')
+        )
+        marked_students = save_attendance(recognized_students, date.today()) if recognized_students else []
         
-        message = f'Attendance marked for {len(marked_students)} students (Demo mode - simulated recognition)'
         return jsonify({
-            'success': True,
-            'message': message,
+            'success': bool(recognized_students),
+            'message': f'Attendance marked for {len(marked_students)} students from {len(images)} frames (Demo mode - simulated recognition)',
+            'tracks': len(recognized_students),
+            'recognized': recognized_students,
             'students': marked_students
         })
     
@@ -272,20 +625,116 @@ def attendance_report():
     except Exception as e:
         return jsonify({'success': False, 'message': f'Error: {str(e)}'})
 
+@app.route('/api/attendance_summary')
+def attendance_summary():
+    """Present/absent/total counts for a day, read from the daily summary"""
+    try:
+        date_str = request.args.get('date')
+        summary_date = datetime.strptime(date_str, '%Y-%m-%d').date() if date_str else date.today()
+        summary = day_summary(
+            db.session, Student, DailySummary, summary_date,
+            class_name=request.args.get('class_name'),
+            section=request.args.get('section')
+        )
+        return jsonify({'success': True, **summary})
+    
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
+@app.route('/api/attendance_range')
+def attendance_range():
+    """Aggregated attendance over a date range, optionally for one class/section"""
+    try:
+        start, end = parse_date_range(request.args)
+        report = attendance_range_report(
+            db.session, Student, Attendance, start, end,
+            class_name=request.args.get('class_name'),
+            section=request.args.get('section'),
+            chronic_threshold=float(request.args.get('chronic', 0.1))
+        )
+        return jsonify({'success': True, **report})
+    
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+
+@app.route('/api/attendance_export')
+def attendance_export():
+    """Stream attendance records for a date range as CSV or NDJSON"""
+    try:
+        start, end = parse_date_range(request.args)
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'success': False, 'message': f'Unknown export format: {export_format}'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
+    
+    encode, mimetype = EXPORT_FORMATS[export_format]
+    rows = export_rows(
+        db.session, Student, Attendance, start, end,
+        class_name=request.args.get('class_name'),
+        section=request.args.get('section'),
+        include_absent=request.args.get('include_absent') in ('1', 'true')
+    )
+    filename = f'attendance_{start}_{end}.{export_format}'
+    return Response(
+        stream_with_context(encode(rows)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.route('/api/events')
+def event_feed():
+    """Server-Sent Events of attendance marks and enrollments, optionally
+    for one ?class_name=&section=; resumes after Last-Event-ID"""
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        cursor = parse_event_id(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({'success': False, 'message': f'Invalid event id: {last_event_id}'})
+    
+    stream = event_stream(
+        db.session, Student, Attendance, StudentChange, event_notifier, cursor,
+        class_name=request.args.get('class_name'),
+        section=request.args.get('section'),
+        poll_interval=app.config['EVENTS_POLL_INTERVAL'],
+        keepalive=app.config['EVENTS_KEEPALIVE']
+    )
+    return Response(
+        stream_with_context(stream),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/students')
 def get_students():
-    students = Student.query.all()
-    students_data = []
-    for student in students:
-        students_data.append({
-            'student_id': student.student_id,
-            'name': student.name,
-            'class': student.class_name,
-            'section': student.section,
-            'photo_path': student.photo_path,
-            'created_at': student.created_at.strftime('%Y-%m-%d %H:%M:%S')
-        })
-    return jsonify({'success': True, 'students': students_data})
+    """A page of the roster: ?class_name=&section=&fields=a,b&limit=&cursor=
+
+    The ETag follows the roster version, so clients revalidating an
+    unchanged roster get a 304 without any rows being read.
+    """
+    try:
+        version = roster_version(db.session, Student, StudentChange)
+        etag = f'{version}-{zlib.crc32(request.query_string):08x}'
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            fields = request.args.get('fields')
+            limit = request.args.get('limit', app.config['STUDENTS_PAGE_SIZE'], type=int)
+            students, next_cursor = student_page(
+                db.session, Student,
+                fields=fields.split(',') if fields else None,
+                class_name=request.args.get('class_name'),
+                section=request.args.get('section'),
+                after=request.args.get('cursor', type=int),
+                limit=max(1, min(limit, app.config['STUDENTS_PAGE_MAX']))
+            )
+            response = jsonify({'success': True, 'students': students, 'next_cursor': next_cursor})
+        response.set_etag(etag, weak=True)
+        # Cache, but revalidate every time
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error: {str(e)}'})
 
 if __name__ == '__main__':
     print("=" * 60)
@@ -304,5 +753,9 @@ if __name__ == '__main__':
     
     with app.app_context():
         db.create_all()
+        migrate(db.engine)
+    # Resume queued attendance jobs in the reloader's serving process
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        attendance_jobs.start()
     
     app.run(debug=True, host='0.0.0.0', port=5000)
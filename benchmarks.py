@@ -0,0 +1,409 @@
+import argparse
+import importlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from encoding_format import pack_encoding
+from image_io import Frame, load_cv2
+
+# Offline benchmarks of the three engines on synthetic data: frame decode,
+# face detection and encoding, gallery load and matching at several roster
+# sizes, attendance writes and /api/attendance_report. Each app is imported
+# against a throwaway SQLite database (through DATABASE_URL), so the real
+# attendance.db is never touched. Results go to JSON for comparison across
+# commits (see --baseline).
+
+# Engine name -> the app module that runs it
+ENGINES = {
+    'dlib': 'app',
+    'histogram': 'app_simple',
+    'demo': 'app_demo',
+}
+
+# Students inserted per INSERT statement while building a roster
+INSERT_CHUNK = 10000
+
+# Synthetic students are spread round-robin over these classes and sections
+CLASSES = 12
+SECTIONS = ('A', 'B', 'C', 'D')
+
+
+def student_class(number):
+    return str(1 + number % CLASSES)
+
+
+def student_section(number):
+    return SECTIONS[number // CLASSES % len(SECTIONS)]
+
+
+def summarize(seconds, items=1):
+    """Latency percentiles of timed runs, and items handled per second"""
+    ms = np.asarray(seconds) * 1000
+    total = float(np.sum(seconds))
+    return {
+        'runs': len(seconds),
+        'median_ms': round(float(np.median(ms)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'per_second': round(items * len(seconds) / total, 1) if total > 0 else None,
+    }
+
+
+def measure(fn, runs, items=1):
+    """Time ``runs`` calls of ``fn``; ``items`` is the work done per call"""
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - start)
+    return summarize(seconds, items)
+
+
+def synthetic_frames(count, width=1280, height=720, seed=0):
+    """JPEG frames of a classroom-sized scene: a smooth background with
+    bright face-sized ellipses. Detectors rarely find faces in them, so
+    encoding is measured on fixed boxes (see ``face_boxes``)."""
+    cv2 = load_cv2()
+    rng = np.random.default_rng(seed)
+    frames = []
+    for _ in range(count):
+        background = rng.integers(40, 200, size=(height // 16, width // 16, 3), dtype=np.uint8)
+        image = cv2.resize(background, (width, height), interpolation=cv2.INTER_CUBIC)
+        for _ in range(rng.integers(3, 8)):
+            center = (int(rng.integers(80, width - 80)), int(rng.integers(80, height - 80)))
+            axes = (int(rng.integers(30, 70)), int(rng.integers(40, 90)))
+            cv2.ellipse(image, center, axes, 0, 0, 360, tuple(int(v) for v in rng.integers(150, 240, 3)), -1)
+        image = np.clip(image + rng.normal(0, 6, image.shape), 0, 255).astype(np.uint8)
+        frames.append(cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])[1].tobytes())
+    return frames
+
+
+def load_images(directory):
+    """Encoded bytes of every JPEG/PNG in ``directory``"""
+    images = []
+    for name in sorted(os.listdir(directory)):
+        if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            with open(os.path.join(directory, name), 'rb') as f:
+                images.append(f.read())
+    return images
+
+
+def face_boxes(frame, count):
+    """``count`` (left, top, right, bottom) face-sized boxes in a row across the frame"""
+    height, width = frame.bgr.shape[:2]
+    side = max(16, min(height // 3, width // (count + 1)))
+    step = (width - side) // max(count, 1)
+    top = (height - side) // 2
+    return [(i * step, top, i * step + side, top + side) for i in range(count)]
+
+
+def encoder_location(encoder, box):
+    """A (left, top, right, bottom) box in the layout ``encoder`` detects faces in"""
+    left, top, right, bottom = box
+    if encoder.kind == 'dlib':
+        return top, right, bottom, left
+    return left, top, right - left, bottom - top
+
+
+def synthetic_encodings(engine, count, rng):
+    """Random encodings shaped like the engine's: dlib-like 128-d vectors,
+    256-bin histograms summing to 1, or the demo's uniform 128-d features"""
+    if engine == 'histogram':
+        return rng.dirichlet(np.ones(256), size=count).astype(np.float32)
+    if engine == 'dlib':
+        return rng.normal(0, 0.08, size=(count, 128)).astype(np.float32)
+    return rng.random((count, 128), dtype=np.float32)
+
+
+def probes_of(engine, encodings, rng):
+    """New captures of enrolled faces: the encodings with a little noise"""
+    if engine == 'histogram':
+        noisy = 0.9 * encodings + 0.1 * rng.dirichlet(np.ones(256), size=len(encodings))
+        return noisy.astype(np.float32)
+    return (encodings + rng.normal(0, 0.01, size=encodings.shape)).astype(np.float32)
+
+
+def import_app(engine, workdir):
+    """The engine's app module, bound to a fresh database in ``workdir``"""
+    db_path = os.path.join(workdir, f'{engine}.db')
+    if os.path.exists(db_path):
+        os.remove(db_path)
+    os.environ['DATABASE_URL'] = f'sqlite:///{db_path}'
+    module = importlib.import_module(ENGINES[engine])
+    module.app.config['TESTING'] = True
+    # Inline recognition, so matching is timed in this process
+    module.app.config['RECOGNITION_WORKERS'] = 0
+    if 'GALLERY_SNAPSHOT_PATH' in module.app.config:
+        module.app.config['GALLERY_SNAPSHOT_PATH'] = os.path.join(workdir, f'{engine}_gallery')
+    with module.app.app_context():
+        module.db.create_all()
+        module.migrate(module.db.engine)
+    return module
+
+
+def grow_roster(module, engine, start, size, rng):
+    """Enroll students ``start`` .. ``size`` - 1 with synthetic encodings;
+    returns the encodings of the first chunk (the probe candidates)"""
+    first = None
+    with module.app.app_context():
+        for offset in range(start, size, INSERT_CHUNK):
+            count = min(INSERT_CHUNK, size - offset)
+            encodings = synthetic_encodings(engine, count, rng)
+            if first is None:
+                first = encodings
+            module.db.session.execute(module.db.insert(module.Student), [
+                {
+                    'student_id': f'S{offset + i:07d}',
+                    'name': f'Student {offset + i}',
+                    'class_name': student_class(offset + i),
+                    'section': student_section(offset + i),
+                    'face_encoding': pack_encoding(encodings[i], engine),
+                    'created_at': datetime.utcnow()
+                }
+                for i in range(count)
+            ])
+            module.db.session.commit()
+    return first
+
+
+def bench_pipeline(module, engine, images, args):
+    """Decode, detect and encode timings with the app's configured detector"""
+    results = []
+    max_side = module.app.config.get('DETECT_MAX_SIDE')
+    source = 'rgb' if engine == 'dlib' else 'gray'
+
+    seconds = []
+    for _ in range(args.repeat):
+        for image_bytes in images:
+            start = time.perf_counter()
+            getattr(Frame(image_bytes, max_side=max_side), source)
+            seconds.append(time.perf_counter() - start)
+    results.append({'stage': 'decode', 'engine': engine, 'source': source, **summarize(seconds)})
+
+    try:
+        encoder = module.make_encoder(engine, detector=module.app.config['FACE_DETECTOR'],
+                                      **module.detector_options())
+    except ImportError as e:
+        print(f"{engine}: detect/encode unavailable ({e})")
+        return results
+
+    detect_seconds, encode_seconds = [], []
+    faces_found = faces_encoded = 0
+    for image_bytes in images:
+        frame = Frame(image_bytes, max_side=max_side)
+        # Decode outside the timed runs
+        getattr(frame, source)
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            locations = encoder.detect_faces(frame)
+            detect_seconds.append(time.perf_counter() - start)
+        faces_found += len(locations)
+
+        if not locations:
+            locations = [encoder_location(encoder, box) for box in face_boxes(frame, args.faces)]
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            encoder.encode_locations(frame, locations)
+            encode_seconds.append((time.perf_counter() - start) / len(locations))
+        faces_encoded += len(locations)
+
+    results.append({'stage': 'detect', 'engine': engine, 'detector': module.app.config['FACE_DETECTOR'],
+                    'max_side': max_side, 'faces_found': faces_found, **summarize(detect_seconds)})
+    # Latency per face
+    results.append({'stage': 'encode', 'engine': engine, 'faces': faces_encoded, **summarize(encode_seconds)})
+    return results
+
+
+def probe_batches(probes, probe_classes, faces):
+    """Frames of ``faces`` probes for school-wide matching, and frames of
+    ``faces`` probes of one class each, with that class, for scoped matching"""
+    school = [(list(probes[i:i + faces]), None) for i in range(0, len(probes) - faces + 1, faces)]
+    by_class = {}
+    for probe, class_name in zip(probes, probe_classes):
+        by_class.setdefault(class_name, []).append(probe)
+    scoped = [(members[i:i + faces], class_name)
+              for class_name, members in sorted(by_class.items())
+              for i in range(0, len(members) - faces + 1, faces)]
+    return school, scoped
+
+
+def bench_roster(module, engine, size, probes, probe_classes, args, report_date):
+    """Engine load and matching, attendance writes and the day's report for
+    a roster of ``size`` students. ``probe_classes`` holds the class of the
+    student each probe was taken from."""
+    results = []
+    module.face_system = None
+    start = time.perf_counter()
+    try:
+        with module.app.app_context():
+            engine_system = module.get_face_system()
+    except ImportError as e:
+        print(f"{engine}: load/match unavailable ({e})")
+        engine_system = None
+    if engine_system is not None:
+        results.append({'stage': 'load', 'engine': engine, 'students': size,
+                        **summarize([time.perf_counter() - start])})
+
+        school, scoped = probe_batches(probes, probe_classes, args.faces)
+        for stage, batches in (('match', school), ('match_class', scoped)):
+            if not batches:
+                continue
+            seconds = []
+            recognized = 0
+            with module.app.app_context():
+                for _ in range(args.repeat):
+                    for batch, class_name in batches:
+                        start = time.perf_counter()
+                        recognized += len(engine_system.identify(batch, class_name=class_name))
+                        seconds.append(time.perf_counter() - start)
+            # Throughput in faces matched per second; every probe is an
+            # enrolled student, so recognized is a sanity check
+            results.append({'stage': stage, 'engine': engine, 'students': size, 'faces_per_frame': args.faces,
+                            'recognized': round(recognized / (len(batches) * args.faces * args.repeat), 4),
+                            **summarize(seconds, items=args.faces)})
+        if getattr(engine_system, 'pool', None):
+            engine_system.pool.shutdown()
+
+    # Each write marks ``faces`` students not yet present that day, as one
+    # frame's recognitions would
+    runs = min(args.writes, size // args.faces)
+    seconds = []
+    with module.app.app_context():
+        for run in range(runs):
+            recognized = [
+                {'student_id': f'S{student:07d}', 'name': f'Student {student}',
+                 'class': student_class(student), 'section': student_section(student),
+                 'confidence': 0.9}
+                for student in range(run * args.faces, (run + 1) * args.faces)
+            ]
+            start = time.perf_counter()
+            module.save_attendance(recognized, report_date)
+            seconds.append(time.perf_counter() - start)
+    if seconds:
+        results.append({'stage': 'attendance_write', 'engine': engine, 'students': size,
+                        'rows_per_write': args.faces, **summarize(seconds, items=args.faces)})
+
+    client = module.app.test_client()
+    url = f'/api/attendance_report?date={report_date.isoformat()}'
+    response = client.get(url)
+    if not response.json.get('success'):
+        print(f"{engine}: attendance_report failed ({response.json.get('message')})")
+    else:
+        # Throughput in report rows (students) per second
+        results.append({'stage': 'attendance_report', 'engine': engine, 'students': size,
+                        **measure(lambda: client.get(url), args.report_runs, items=size)})
+    return results
+
+
+def result_key(result):
+    return result['stage'], result['engine'], result.get('students')
+
+
+def compare(results, baseline_path):
+    """Print the change in median latency against an earlier results file"""
+    with open(baseline_path) as f:
+        baseline = {result_key(result): result for result in json.load(f)['results']}
+    print(f"\n{'stage':<18} {'engine':<10} {'students':>9} {'before ms':>10} {'after ms':>10} {'change':>8}")
+    for result in results:
+        before = baseline.get(result_key(result))
+        if before is None or not before['median_ms']:
+            continue
+        change = result['median_ms'] / before['median_ms'] - 1
+        print(f"{result['stage']:<18} {result['engine']:<10} {str(result.get('students') or '-'):>9} "
+              f"{before['median_ms']:>10.3f} {result['median_ms']:>10.3f} {change:>+8.1%}")
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    workdir = args.workdir or tempfile.mkdtemp(prefix='attendance-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    images = load_images(args.images) if args.images else synthetic_frames(args.frames, *args.frame_size)
+    sizes = sorted(args.sizes)
+    results = []
+    try:
+        for engine in args.engines:
+            module = import_app(engine, workdir)
+            if engine != 'demo':
+                results.extend(bench_pipeline(module, engine, images, args))
+
+            rng = np.random.default_rng(args.seed)
+            enrolled = 0
+            probes = None
+            for day, size in enumerate(sizes):
+                start = time.perf_counter()
+                first = grow_roster(module, engine, enrolled, size, rng)
+                print(f"{engine}: enrolled {size} students ({time.perf_counter() - start:.1f} s)")
+                if probes is None:
+                    # The first roster starts at student 0, so a row is a student number
+                    rows = rng.choice(len(first), min(args.queries, len(first)), replace=False)
+                    probes = probes_of(engine, first[rows], rng)
+                    probe_classes = [student_class(int(row)) for row in rows]
+                enrolled = size
+                # A new date per roster size, so every write marks new rows
+                results.extend(bench_roster(module, engine, size, probes, probe_classes, args, date(2000, 1, 1) + timedelta(day)))
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    for result in results:
+        print(f"{result['stage']:<18} {result['engine']:<10} {str(result.get('students') or '-'):>9} "
+              f"{result['median_ms']:>10.3f} ms median {result['p95_ms']:>10.3f} ms p95 "
+              f"{result['per_second'] or 0:>12.1f}/s")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the recognition and reporting paths on synthetic data')
+    parser.add_argument('--engines', default=','.join(ENGINES), type=lambda value: value.split(','),
+                        help='Comma-separated engines to measure (dlib needs face_recognition)')
+    parser.add_argument('--sizes', default='100,1000,10000,100000,500000',
+                        type=lambda value: [int(size) for size in value.split(',')],
+                        help='Roster sizes, e.g. 100,10000,500000')
+    parser.add_argument('--images', help='Directory of JPEG/PNG frames to use instead of synthetic ones')
+    parser.add_argument('--frames', type=int, default=8, help='Synthetic frames to generate')
+    parser.add_argument('--frame-size', type=int, nargs=2, default=(1280, 720), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--faces', type=int, default=5, help='Faces per frame for encoding, matching and writes')
+    parser.add_argument('--queries', type=int, default=200, help='Probe encodings matched per roster size')
+    parser.add_argument('--writes', type=int, default=50, help='Attendance writes per roster size')
+    parser.add_argument('--report-runs', type=int, default=5, help='Timed attendance_report requests per roster size')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per frame or probe batch')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', help='Keep the benchmark databases here instead of a temporary directory')
+    parser.add_argument('--output', help='Write the results to this JSON file')
+    parser.add_argument('--baseline', help='Earlier --output file to compare median latencies against')
+    args = parser.parse_args()
+
+    unknown = set(args.engines) - set(ENGINES)
+    if unknown:
+        parser.error(f"unknown engines: {', '.join(sorted(unknown))}")
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'commit': git_commit(),
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'python': sys.version.split()[0],
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'options': {key: value for key, value in vars(args).items() if key not in ('output', 'baseline')},
+                'results': results,
+            }, f, indent=2)
+    if args.baseline:
+        compare(results, args.baseline)
@@ -0,0 +1,97 @@
+from collections import Counter
+
+from sqlalchemy import func
+
+from database import insert_new_rows
+
+
+def _enrollment(session, Student, class_name=None, section=None):
+    """{(class_name, section): enrolled students}"""
+    query = session.query(Student.class_name, Student.section, func.count(Student.id))
+    if class_name is not None:
+        query = query.filter(Student.class_name == class_name, Student.section == section)
+    return {(class_value, section_value): count
+            for class_value, section_value, count in query.group_by(Student.class_name, Student.section)}
+
+
+def _is_seeded(session, DailySummary, day):
+    return session.query(DailySummary.id).filter(DailySummary.date == day).first() is not None
+
+
+def seed_day(session, Student, DailySummary, day):
+    """Create ``day``'s rows from the current enrollment, once per day"""
+    if _is_seeded(session, DailySummary, day):
+        return
+    insert_new_rows(session, DailySummary, [
+        {'date': day, 'class_name': class_name, 'section': section, 'present': 0, 'total': total}
+        for (class_name, section), total in _enrollment(session, Student).items()
+    ], conflict_columns=['date', 'class_name', 'section'], returning='class_name')
+
+
+def _increment(session, Student, DailySummary, day, class_name, section, present=0, total=0):
+    updated = session.query(DailySummary).filter_by(
+        date=day, class_name=class_name, section=section
+    ).update({
+        DailySummary.present: DailySummary.present + present,
+        DailySummary.total: DailySummary.total + total
+    }, synchronize_session=False)
+    if not updated:
+        # A class/section first seen after the day was seeded
+        session.flush()
+        enrolled = _enrollment(session, Student, class_name, section).get((class_name, section), 0)
+        session.add(DailySummary(date=day, class_name=class_name, section=section,
+                                 present=present, total=max(enrolled, present)))
+
+
+def record_presences(session, Student, DailySummary, day, marked):
+    """Count newly marked students on ``day``; ``marked`` holds one
+    (class_name, section) pair per student. Runs in the caller's transaction."""
+    if not marked:
+        return
+    seed_day(session, Student, DailySummary, day)
+    for (class_name, section), count in Counter(marked).items():
+        _increment(session, Student, DailySummary, day, class_name, section, present=count)
+
+
+def record_enrollment(session, Student, DailySummary, day, class_name, section):
+    """Count a newly enrolled student on ``day``. Nothing to do before the
+    day is seeded: seeding reads the enrollment, new student included."""
+    if _is_seeded(session, DailySummary, day):
+        _increment(session, Student, DailySummary, day, class_name, section, total=1)
+
+
+def day_summary(session, Student, DailySummary, day, class_name=None, section=None):
+    """Present/absent/total for ``day``, overall and per class/section.
+
+    Reads the maintained summary rows, one per class/section; before
+    anyone is marked that day everyone enrolled counts as absent.
+    """
+    if _is_seeded(session, DailySummary, day):
+        query = session.query(DailySummary.class_name, DailySummary.section,
+                              DailySummary.present, DailySummary.total).filter(DailySummary.date == day)
+        if class_name:
+            query = query.filter(DailySummary.class_name == class_name)
+        if section:
+            query = query.filter(DailySummary.section == section)
+        rows = query.order_by(DailySummary.class_name, DailySummary.section).all()
+    else:
+        rows = sorted(
+            (class_value, section_value, 0, total)
+            for (class_value, section_value), total in _enrollment(session, Student).items()
+            if (not class_name or class_value == class_name) and (not section or section_value == section)
+        )
+
+    classes = [
+        {'class': class_value, 'section': section_value,
+         'present': present, 'absent': total - present, 'total': total}
+        for class_value, section_value, present, total in rows
+    ]
+    present = sum(row['present'] for row in classes)
+    total = sum(row['total'] for row in classes)
+    return {
+        'date': str(day),
+        'present': present,
+        'absent': total - present,
+        'total': total,
+        'classes': classes
+    }
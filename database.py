@@ -0,0 +1,136 @@
+import sqlite3
+
+from sqlalchemy import event, insert, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+
+# Applied to every new SQLite connection. WAL lets report queries read while
+# a camera request writes; synchronous=NORMAL is durable enough under WAL
+# and avoids an fsync per commit.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 30000,      # ms to wait on a writer instead of "database is locked"
+    'cache_size': -16000,       # 16 MB page cache per connection
+    'mmap_size': 134217728,     # read the first 128 MB of the file through mmap
+    'temp_store': 'MEMORY',
+}
+
+
+def sqlite_engine_options(pool_size=10, max_overflow=10):
+    """SQLALCHEMY_ENGINE_OPTIONS for a file-backed SQLite database shared by
+    Flask's request threads"""
+    return {
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': 30,
+        'pool_recycle': 3600,
+        'connect_args': {'timeout': 30, 'check_same_thread': False},
+    }
+
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+    cursor.close()
+
+
+def insert_new_rows(session, model, rows, conflict_columns, returning):
+    """Insert ``rows`` in one statement, skipping any that collide with an
+    existing row on the unique ``conflict_columns``.
+
+    Returns the set of ``returning`` column values of the rows actually
+    inserted. Runs in the session's transaction; the caller commits.
+    """
+    if not rows:
+        return set()
+
+    dialect = session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        dialect_insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        if dialect == 'postgresql' or sqlite3.sqlite_version_info >= (3, 35):
+            statement = dialect_insert(model).values(rows).on_conflict_do_nothing(index_elements=conflict_columns)
+            return {value for (value,) in session.execute(statement.returning(getattr(model, returning)))}
+
+        # SQLite before 3.35 has no RETURNING: one guarded insert per row
+        inserted = set()
+        for row in rows:
+            if session.execute(dialect_insert(model).values(row).on_conflict_do_nothing()).rowcount:
+                inserted.add(row[returning])
+        return inserted
+
+    # Other databases: check, then insert
+    inserted = set()
+    for row in rows:
+        exists = session.query(model).filter_by(**{name: row[name] for name in conflict_columns}).first()
+        if exists is None:
+            session.execute(insert(model).values(row))
+            inserted.add(row[returning])
+    return inserted
+
+
+def attendance_unique_per_day(connection):
+    """Drop duplicate (student_id, date) attendance rows, keeping the earliest,
+    and enforce uniqueness from now on"""
+    connection.execute(text(
+        'DELETE FROM attendance WHERE id NOT IN '
+        '(SELECT MIN(id) FROM attendance GROUP BY student_id, date)'
+    ))
+    connection.execute(text(
+        'CREATE UNIQUE INDEX IF NOT EXISTS uq_attendance_student_date ON attendance (student_id, date)'
+    ))
+
+
+def reporting_indexes(connection):
+    """Indexes behind the date filters of reports and the class/section scopes"""
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_attendance_date ON attendance (date)'))
+    connection.execute(text(
+        'CREATE INDEX IF NOT EXISTS ix_student_class_section ON student (class_name, section)'
+    ))
+    connection.execute(text('ANALYZE'))
+
+
+def daily_summary_backfill(connection):
+    """Build daily_summary rows for days marked before the table existed.
+    Students count towards the days from their registration date on."""
+    connection.execute(text(
+        'INSERT OR IGNORE INTO daily_summary (date, class_name, section, present, total) '
+        'SELECT days.date, student.class_name, student.section, COUNT(attendance.id), COUNT(student.id) '
+        'FROM (SELECT DISTINCT date FROM attendance) AS days '
+        'JOIN student ON date(student.created_at) <= days.date '
+        'LEFT JOIN attendance ON attendance.student_id = student.student_id AND attendance.date = days.date '
+        'GROUP BY days.date, student.class_name, student.section'
+    ))
+
+
+def recognition_job_owner(connection):
+    """Record which process claimed a background recognition job"""
+    columns = {row[1] for row in connection.execute(text('PRAGMA table_info(recognition_job)'))}
+    if 'owner' not in columns:
+        connection.execute(text('ALTER TABLE recognition_job ADD COLUMN owner VARCHAR(64)'))
+
+
+# Schema migrations for databases created by older versions, applied in
+# order. Each must be idempotent: fresh databases already have the change
+# from db.create_all() and still run every step once.
+MIGRATIONS = [
+    attendance_unique_per_day,
+    reporting_indexes,
+    daily_summary_backfill,
+    recognition_job_owner,
+]
+
+
+def migrate(engine):
+    """Apply pending MIGRATIONS, tracking progress in SQLite's user_version"""
+    if engine.dialect.name != 'sqlite':
+        return
+    with engine.begin() as connection:
+        applied = connection.execute(text('PRAGMA user_version')).scalar() or 0
+        for number, migration in enumerate(MIGRATIONS[applied:], start=applied + 1):
+            migration(connection)
+            connection.execute(text(f'PRAGMA user_version = {number}'))
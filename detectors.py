@@ -0,0 +1,243 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from image_io import Frame
+from tracking import box_iou
+
+# Face detection backends. Every detector returns face boxes as
+# (left, top, right, bottom) at the frame's full resolution; the encoders
+# convert them to the layout their models expect. As in face_encoders.py,
+# OpenCV and face_recognition are imported when a detector is first built.
+cv2 = None
+face_recognition = None
+
+
+class HaarDetector:
+    """OpenCV's frontal-face Haar cascade: fast on a CPU, fewer faces found
+    in profile or poor light.
+
+    ``min_size`` is the smallest face side to report, in full-resolution
+    pixels (None: the cascade's own 24 px window at detection size).
+    """
+
+    name = 'haar'
+
+    def __init__(self, scale_factor=1.3, min_neighbors=5, min_size=None):
+        global cv2
+        import cv2
+        self.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+
+    def detect(self, frame):
+        gray, scale = frame.for_detection(frame.gray)
+        options = {}
+        if self.min_size:
+            side = max(1, round(self.min_size * scale))
+            options['minSize'] = (side, side)
+        faces = self.cascade.detectMultiScale(gray, self.scale_factor, self.min_neighbors, **options)
+        return frame.to_full_resolution([(x, y, x + w, y + h) for x, y, w, h in faces], scale)
+
+
+class DlibDetector:
+    """dlib's detectors through face_recognition. ``upsample`` enlarges the
+    image that many times first to find smaller faces, at a steep cost."""
+
+    name = None
+    model = None
+
+    def __init__(self, upsample=1, min_size=None):
+        global face_recognition
+        import face_recognition
+        self.upsample = upsample
+        self.min_size = min_size
+
+    def detect(self, frame):
+        image, scale = frame.for_detection(frame.rgb)
+        locations = face_recognition.face_locations(image, number_of_times_to_upsample=self.upsample,
+                                                    model=self.model)
+        boxes = frame.to_full_resolution([(left, top, right, bottom) for top, right, bottom, left in locations], scale)
+        if self.min_size:
+            boxes = [box for box in boxes if min(box[2] - box[0], box[3] - box[1]) >= self.min_size]
+        return boxes
+
+
+class HogDetector(DlibDetector):
+    """dlib's HOG + linear SVM detector (the face_recognition default)"""
+
+    name = 'hog'
+    model = 'hog'
+
+
+class CnnDetector(DlibDetector):
+    """dlib's CNN (MMOD) detector: finds more faces at more angles, but is
+    only practical with a CUDA build of dlib"""
+
+    name = 'cnn'
+    model = 'cnn'
+
+
+class CascadeDetector:
+    """A cheap Haar pass proposes face regions and only those are used.
+
+    By default the Haar boxes are returned as they are, so dlib's landmarks
+    and encodings run on those crops and the full-frame HOG pass is skipped.
+    With ``verify`` each candidate is confirmed by HOG on its own crop,
+    enlarged by ``margin`` and scaled to about ``crop_side`` pixels. That
+    drops Haar false positives for a fraction of a full-frame HOG pass.
+    """
+
+    name = 'cascade'
+
+    def __init__(self, scale_factor=1.2, min_neighbors=4, min_size=None, verify=False, margin=0.25,
+                 crop_side=160, upsample=0):
+        global face_recognition
+        self.haar = HaarDetector(scale_factor, min_neighbors, min_size)
+        self.verify = verify
+        self.margin = margin
+        self.crop_side = crop_side
+        self.upsample = upsample
+        if verify:
+            import face_recognition
+
+    def detect(self, frame):
+        if self.verify:
+            # Verification crops the colour image: decode it once for both passes
+            frame.expect_color()
+        candidates = self.haar.detect(frame)
+        if not self.verify or not candidates:
+            return candidates
+
+        image = frame.rgb
+        height, width = image.shape[:2]
+        boxes = []
+        for left, top, right, bottom in candidates:
+            pad = int((right - left) * self.margin)
+            x0, y0 = max(0, left - pad), max(0, top - pad)
+            x1, y1 = min(width, right + pad), min(height, bottom + pad)
+            # dlib finds nothing in a non-contiguous slice, and returns no error
+            crop = np.ascontiguousarray(image[y0:y1, x0:x1])
+            # Small crops are enlarged too: HOG misses faces under about 80 px
+            scale = self.crop_side / max(crop.shape[:2])
+            if scale != 1.0:
+                crop = cv2.resize(crop, (max(1, round(crop.shape[1] * scale)), max(1, round(crop.shape[0] * scale))),
+                                  interpolation=cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR)
+            found = face_recognition.face_locations(crop, number_of_times_to_upsample=self.upsample)
+            if found:
+                top_, right_, bottom_, left_ = max(found, key=lambda l: (l[1] - l[3]) * (l[2] - l[0]))
+                boxes.append((x0 + int(left_ / scale), y0 + int(top_ / scale),
+                              x0 + int(right_ / scale), y0 + int(bottom_ / scale)))
+        return boxes
+
+
+DETECTORS = {
+    HaarDetector.name: HaarDetector,
+    HogDetector.name: HogDetector,
+    CnnDetector.name: CnnDetector,
+    CascadeDetector.name: CascadeDetector,
+}
+
+
+def make_detector(name, **options):
+    """Build the detector registered under ``name``"""
+    if name not in DETECTORS:
+        raise ValueError(f'Unknown face detector: {name}')
+    return DETECTORS[name](**options)
+
+
+def match_boxes(found, expected, iou_threshold=0.5):
+    """Number of ``expected`` boxes matched one-to-one by a ``found`` box"""
+    pairs = sorted(((box_iou(a, b), i, j) for i, a in enumerate(found) for j, b in enumerate(expected)), reverse=True)
+    used_found, used_expected = set(), set()
+    for iou, i, j in pairs:
+        if iou < iou_threshold:
+            break
+        if i not in used_found and j not in used_expected:
+            used_found.add(i)
+            used_expected.add(j)
+    return len(used_expected)
+
+
+def evaluate_detector(detector, samples, max_side=640, repeat=3):
+    """Latency and, for labelled samples, accuracy of one detector.
+
+    ``samples`` is a list of (image bytes, expected boxes or None). Each
+    image is decoded once outside the timing; the median of ``repeat``
+    runs is its latency.
+    """
+    latencies = []
+    found_total = labelled_found = expected_total = matched_total = 0
+    labelled = False
+    for image_bytes, expected in samples:
+        frame = Frame(image_bytes, max_side=max_side)
+        # Decode outside the timed runs
+        _ = frame.rgb, frame.gray
+        runs = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            found = detector.detect(frame)
+            runs.append(time.perf_counter() - start)
+        latencies.append(float(np.median(runs)) * 1000)
+        found_total += len(found)
+        if expected is not None:
+            labelled = True
+            labelled_found += len(found)
+            expected_total += len(expected)
+            matched_total += match_boxes(found, expected)
+
+    result = {
+        'detector': detector.name,
+        'images': len(samples),
+        'faces_found': found_total,
+        'latency_ms_median': round(float(np.median(latencies)), 2) if latencies else None,
+        'latency_ms_p95': round(float(np.percentile(latencies, 95)), 2) if latencies else None,
+    }
+    if labelled:
+        result['precision'] = round(matched_total / labelled_found, 4) if labelled_found else None
+        result['recall'] = round(matched_total / expected_total, 4) if expected_total else None
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measure face detector latency and accuracy on a set of images')
+    parser.add_argument('--images', required=True, help='Directory of JPEG/PNG images')
+    parser.add_argument('--labels', help='JSON mapping file name to a list of [left, top, right, bottom] face boxes')
+    parser.add_argument('--detectors', default=','.join(DETECTORS), help='Comma-separated detectors to measure')
+    parser.add_argument('--options', default='{}', help='JSON of options per detector, e.g. {"hog": {"upsample": 0}}')
+    parser.add_argument('--max-side', type=int, default=640, help='Longest side frames are downscaled to for detection')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per image')
+    parser.add_argument('--output', help='Also write the results to this JSON file')
+    args = parser.parse_args()
+
+    labels = {}
+    if args.labels:
+        with open(args.labels) as f:
+            labels = json.load(f)
+    samples = []
+    for name in sorted(os.listdir(args.images)):
+        if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+            with open(os.path.join(args.images, name), 'rb') as f:
+                samples.append((f.read(), labels.get(name) if args.labels else None))
+
+    options = json.loads(args.options)
+    results = []
+    for name in args.detectors.split(','):
+        try:
+            detector = make_detector(name, **options.get(name, {}))
+        except ImportError as e:
+            print(f"{name}: unavailable ({e})")
+            continue
+        result = evaluate_detector(detector, samples, max_side=args.max_side, repeat=args.repeat)
+        results.append(result)
+        print(f"{name}: {result['latency_ms_median']} ms median, {result['latency_ms_p95']} ms p95, "
+              f"{result['faces_found']} faces"
+              + (f", precision {result['precision']}, recall {result['recall']}" if 'recall' in result else ''))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'max_side': args.max_side, 'images': len(samples), 'results': results}, f, indent=2)
@@ -0,0 +1,184 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+# Bumped when the layout of cached entries changes
+CACHE_FORMAT_VERSION = 1
+
+# Written into every fingerprint directory; only directories holding it are
+# ever removed, so a misconfigured cache directory cannot lose other data
+MARKER_FILE = '.encoding-cache'
+
+
+def config_fingerprint(kind, options):
+    """Short hash of everything that decides which faces an encoder finds and
+    how it encodes them; cached entries are only reused under the same one"""
+    config = json.dumps({'format': CACHE_FORMAT_VERSION, 'kind': kind, 'options': options},
+                        sort_keys=True, default=str)
+    return hashlib.blake2b(config.encode(), digest_size=8).hexdigest()
+
+
+class EncodingCache:
+    """Detected face locations and encodings per decoded frame.
+
+    Entries are keyed by a hash of the decoded pixels (and the detection
+    size), so a resubmitted capture skips detection and encoding and goes
+    straight to matching. Up to ``max_entries`` entries stay in memory in
+    LRU order. With a ``directory``, entries are also written there, up to
+    about ``max_disk_entries``, and shared by worker processes and restarts.
+
+    Entries only depend on the image and ``fingerprint`` (the detector and
+    encoder config): gallery changes never invalidate them. Directories of
+    other fingerprints that this cache wrote are removed when it is opened.
+    """
+
+    def __init__(self, fingerprint, max_entries=256, directory=None, max_disk_entries=4096):
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.directory = None
+        if directory:
+            self.directory = os.path.join(directory, fingerprint)
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, MARKER_FILE), 'w') as f:
+                f.write(f'{CACHE_FORMAT_VERSION}\n')
+            # Entries written under another detector/encoder config are stale
+            for name in os.listdir(directory):
+                old = os.path.join(directory, name)
+                if (name != fingerprint and re.fullmatch('[0-9a-f]{16}', name)
+                        and os.path.isfile(os.path.join(old, MARKER_FILE))):
+                    shutil.rmtree(old, ignore_errors=True)
+            self.disk_writes = len(glob.glob(os.path.join(glob.escape(self.directory), '*.npz')))
+
+    def key(self, image, max_side):
+        """Cache key of a decoded image detected at ``max_side``"""
+        image = np.ascontiguousarray(image)
+        digest = hashlib.blake2b(image.data, digest_size=16)
+        digest.update(f'{image.shape}:{image.dtype}:{max_side}'.encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """(locations, encodings) cached under ``key``, or None"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._read(key) if self.directory else None
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key, locations, encodings):
+        entry = ([tuple(int(v) for v in location) for location in locations],
+                 [np.asarray(encoding) for encoding in encodings])
+        with self.lock:
+            self._remember(key, entry)
+        if self.directory:
+            self._write(key, entry)
+
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f'{key}.npz')
+
+    def _read(self, key):
+        try:
+            with np.load(self._path(key)) as data:
+                locations = [tuple(int(v) for v in location) for location in data['locations']]
+                encodings = list(data['encodings'])
+        except (OSError, KeyError, ValueError):
+            return None
+        return locations, encodings
+
+    def _write(self, key, entry):
+        locations, encodings = entry
+        tmp_path = f'{self._path(key)}.{uuid.uuid4().hex[:8]}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, locations=np.array(locations, dtype=np.int64).reshape(-1, 4),
+                         encodings=np.stack(encodings) if encodings else np.zeros((0, 0)))
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            print(f"Error writing encoding cache entry: {e}")
+            return
+
+        with self.lock:
+            self.disk_writes += 1
+            prune = self.disk_writes > self.max_disk_entries
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Drop the least recently written files, down to 3/4 of the limit"""
+        try:
+            paths = sorted(glob.glob(os.path.join(glob.escape(self.directory), '*.npz')), key=os.path.getmtime)
+        except OSError:
+            return
+        excess = len(paths) - self.max_disk_entries * 3 // 4
+        for path in paths[:max(excess, 0)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        with self.lock:
+            self.disk_writes = len(paths) - max(excess, 0)
+
+
+class CachedEncoder:
+    """An encoder whose detections and encodings are cached per frame.
+
+    Behaves like the wrapped encoder; ``encode_faces`` and ``detect_faces``
+    answer repeated frames from the cache.
+    """
+
+    def __init__(self, encoder, cache):
+        self.encoder = encoder
+        self.cache = cache
+        self.kind = encoder.kind
+        self.dim = encoder.dim
+
+    def __getattr__(self, name):
+        return getattr(self.encoder, name)
+
+    def frame_key(self, frame):
+        return self.cache.key(getattr(frame, self.encoder.source), frame.max_side)
+
+    def detect_faces(self, frame):
+        entry = self.cache.get(self.frame_key(frame))
+        if entry is not None:
+            return entry[0]
+        return self.encoder.detect_faces(frame)
+
+    def encode_faces(self, frame):
+        key = self.frame_key(frame)
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry[1]
+
+        locations = self.encoder.detect_faces(frame)
+        encodings = self.encoder.encode_locations(frame, locations) if len(locations) else []
+        self.cache.put(key, locations, encodings)
+        return encodings
@@ -0,0 +1,134 @@
+import argparse
+import pickle
+import sqlite3
+import struct
+from datetime import datetime
+
+import numpy as np
+
+# Stored face encodings are an 8-byte header followed by the raw
+# little-endian float32 vector:
+#   magic b'FE' | format version (u8) | engine code (u8) | dimension (u16) | reserved (u16)
+MAGIC = b'FE'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<2sBBHH')
+
+# Engine that produced an encoding; encodings of different engines are not comparable
+ENGINE_CODES = {'dlib': 1, 'histogram': 2, 'demo': 3}
+ENGINE_NAMES = {code: name for name, code in ENGINE_CODES.items()}
+ENGINE_DIMS = {'dlib': 128, 'histogram': 256, 'demo': 128}
+
+
+class EncodingFormatError(ValueError):
+    """A stored blob is not a current-format encoding of the expected engine"""
+
+
+def encoding_header(engine, dim):
+    return HEADER.pack(MAGIC, FORMAT_VERSION, ENGINE_CODES[engine], dim, 0)
+
+
+def pack_encoding(encoding, engine):
+    """Serialize one encoding as header + little-endian float32"""
+    vector = np.asarray(encoding, dtype='<f4').ravel()
+    return encoding_header(engine, len(vector)) + vector.tobytes()
+
+
+def read_header(blob):
+    """(engine, dimension) of a stored encoding"""
+    if blob is None or len(blob) < HEADER.size or bytes(blob[:2]) != MAGIC:
+        raise EncodingFormatError('Not a packed face encoding (legacy pickle?)')
+    _, version, code, dim, _ = HEADER.unpack_from(blob)
+    if version != FORMAT_VERSION or code not in ENGINE_NAMES:
+        raise EncodingFormatError(f'Unsupported encoding format {version} / engine {code}')
+    if len(blob) != HEADER.size + 4 * dim:
+        raise EncodingFormatError('Truncated face encoding')
+    return ENGINE_NAMES[code], dim
+
+
+def unpack_encoding(blob, engine=None):
+    """float32 vector of one stored encoding, checked against ``engine`` if given"""
+    found, dim = read_header(blob)
+    if engine and found != engine:
+        raise EncodingFormatError(f'Encoding was made by the {found} engine, not {engine}')
+    return np.frombuffer(blob, dtype='<f4', count=dim, offset=HEADER.size)
+
+
+def unpack_encodings(blobs, engine):
+    """Decode many stored encodings of one engine in a single ``np.frombuffer``.
+
+    Returns the (n_valid, dim) matrix and a boolean mask over ``blobs``
+    marking which ones were valid current-format encodings of ``engine``.
+    """
+    dim = ENGINE_DIMS[engine]
+    expected = encoding_header(engine, dim)
+    size = HEADER.size + 4 * dim
+    valid = np.array([
+        blob is not None and len(blob) == size and bytes(blob[:HEADER.size]) == expected
+        for blob in blobs
+    ], dtype=bool)
+
+    row = np.dtype([('header', 'V%d' % HEADER.size), ('encoding', '<f4', (dim,))])
+    buffer = b''.join(blob for blob, ok in zip(blobs, valid) if ok)
+    return np.frombuffer(buffer, dtype=row)['encoding'], valid
+
+
+def migrate_database(db_path, engine=None, dry_run=False):
+    """Rewrite legacy pickled ``student.face_encoding`` rows in the packed format.
+
+    The engine is taken from ``engine`` or guessed from the vector length
+    (128 -> dlib, 256 -> histogram); pass ``engine='demo'`` for demo databases.
+    Only run this on a database you trust: it unpickles every legacy row.
+    """
+    engine_by_dim = {128: 'dlib', 256: 'histogram'}
+    connection = sqlite3.connect(db_path)
+    try:
+        rows = connection.execute(
+            'SELECT id, student_id, face_encoding FROM student WHERE face_encoding IS NOT NULL'
+        ).fetchall()
+
+        updates = []
+        converted_ids = []
+        counts = {'converted': 0, 'current': 0, 'failed': 0}
+        for row_id, student_id, blob in rows:
+            if bytes(blob[:2]) == MAGIC:
+                counts['current'] += 1
+                continue
+            try:
+                vector = np.asarray(pickle.loads(blob), dtype=np.float64).ravel()
+                updates.append((pack_encoding(vector, engine or engine_by_dim[len(vector)]), row_id))
+                converted_ids.append(student_id)
+                counts['converted'] += 1
+            except Exception as e:
+                print(f"Error converting encoding of {student_id}: {e}")
+                counts['failed'] += 1
+
+        if updates and not dry_run:
+            connection.executemany('UPDATE student SET face_encoding = ? WHERE id = ?', updates)
+            # Log the rewrites as roster changes so running apps re-read these
+            # rows and gallery snapshots are invalidated
+            has_change_log = connection.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'student_change'"
+            ).fetchone()
+            if has_change_log:
+                now = datetime.utcnow().isoformat(' ')
+                connection.executemany(
+                    "INSERT INTO student_change (student_id, operation, created_at) VALUES (?, 'add', ?)",
+                    [(student_id, now) for student_id in converted_ids]
+                )
+            connection.commit()
+        return counts
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Convert pickled face encodings to the packed float32 format')
+    parser.add_argument('--db', default='instance/attendance.db', help='SQLite database to migrate')
+    parser.add_argument('--engine', choices=sorted(ENGINE_CODES),
+                        help='Engine that produced the encodings (default: guess from length)')
+    parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing')
+    args = parser.parse_args()
+
+    counts = migrate_database(args.db, args.engine, args.dry_run)
+    print(f"{counts['converted']} converted, {counts['current']} already current, {counts['failed']} failed"
+          + (' (dry run)' if args.dry_run else ''))
@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+
+from sqlalchemy import func
+
+from reports import scope_filters
+
+
+class EventNotifier:
+    """Wakes event streams in this process as soon as new events are committed.
+
+    Streams also poll, so events committed by other worker processes
+    arrive within the poll interval.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.sequence = 0
+
+    def notify(self):
+        with self.condition:
+            self.sequence += 1
+            self.condition.notify_all()
+
+    def wait(self, seen, timeout):
+        """Block until something newer than ``seen`` was committed, or ``timeout``
+        elapses; returns the current sequence"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.sequence != seen, timeout)
+            return self.sequence
+
+
+def format_event_id(cursor):
+    return f'{cursor[0]}-{cursor[1]}'
+
+
+def parse_event_id(value):
+    """(attendance id, student change id) a client has seen, from a Last-Event-ID"""
+    attendance_id, change_id = value.split('-')
+    return int(attendance_id), int(change_id)
+
+
+def latest_cursor(session, Attendance, StudentChange):
+    return (session.query(func.max(Attendance.id)).scalar() or 0,
+            session.query(func.max(StudentChange.id)).scalar() or 0)
+
+
+def events_after(session, Student, Attendance, StudentChange, cursor, class_name=None, section=None, batch=500):
+    """Attendance and enrollment events committed after ``cursor``.
+
+    Returns the events as (event type, payload) and the cursor to resume
+    from. The cursor advances over rows outside the class/section filter
+    too, and at most ``batch`` rows of each kind are read per call.
+    """
+    latest = latest_cursor(session, Attendance, StudentChange)
+    upper = (min(latest[0], cursor[0] + batch), min(latest[1], cursor[1] + batch))
+    scope = scope_filters(Student, class_name, section)
+    events = []
+
+    if upper[1] > cursor[1]:
+        enrolled = session.query(
+            StudentChange.id, Student.student_id, Student.name, Student.class_name, Student.section
+        ).join(
+            Student, Student.student_id == StudentChange.student_id
+        ).filter(
+            StudentChange.id > cursor[1], StudentChange.id <= upper[1], StudentChange.operation == 'add', *scope
+        ).order_by(StudentChange.id)
+        for _, student_id, name, class_value, section_value in enrolled:
+            events.append(('enrollment', {
+                'student_id': student_id,
+                'name': name,
+                'class': class_value,
+                'section': section_value
+            }))
+
+    if upper[0] > cursor[0]:
+        marked = session.query(
+            Attendance.date, Attendance.time_in, Attendance.status, Attendance.confidence,
+            Student.student_id, Student.name, Student.class_name, Student.section
+        ).join(
+            Student, Student.student_id == Attendance.student_id
+        ).filter(
+            Attendance.id > cursor[0], Attendance.id <= upper[0], *scope
+        ).order_by(Attendance.id)
+        for day, time_in, status, confidence, student_id, name, class_value, section_value in marked:
+            events.append(('attendance', {
+                'student_id': student_id,
+                'name': name,
+                'class': class_value,
+                'section': section_value,
+                'date': str(day),
+                'status': status,
+                'time_in': time_in.strftime('%H:%M:%S') if time_in else None,
+                'confidence': round(confidence, 4) if confidence is not None else None
+            }))
+
+    return events, upper
+
+
+def sse_message(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def event_stream(session, Student, Attendance, StudentChange, notifier, cursor=None, class_name=None,
+                 section=None, poll_interval=2, keepalive=15):
+    """Server-Sent Events for attendance and enrollments, from ``cursor`` on
+    (or from now). Each message id resumes the stream via Last-Event-ID."""
+    if cursor is None:
+        cursor = latest_cursor(session, Attendance, StudentChange)
+        session.rollback()
+    # Reconnect after 3 s if the connection drops
+    yield f'retry: 3000\nid: {format_event_id(cursor)}\n\n'
+
+    seen = notifier.sequence
+    idle_since = time.monotonic()
+    while True:
+        events, next_cursor = events_after(session, Student, Attendance, StudentChange, cursor, class_name, section)
+        # End the read transaction so the next poll sees new commits, and
+        # give the connection back while waiting
+        session.rollback()
+
+        if next_cursor != cursor:
+            cursor = next_cursor
+            for number, (event, data) in enumerate(events, start=1):
+                # Only the last message of a batch carries the resume point
+                yield sse_message(event, data, format_event_id(cursor) if number == len(events) else None)
+            if not events:
+                # Everything in between was outside the filter: still move the resume point
+                yield f'id: {format_event_id(cursor)}\n\n'
+            idle_since = time.monotonic()
+            continue
+
+        if time.monotonic() - idle_since >= keepalive:
+            yield ': keepalive\n\n'
+            idle_since = time.monotonic()
+        seen = notifier.wait(seen, poll_interval)
@@ -0,0 +1,132 @@
+from detectors import make_detector
+from encoding_cache import CachedEncoder, EncodingCache, config_fingerprint
+
+# OpenCV and face_recognition (which loads the dlib models) are imported
+# when an encoder is first built, so importing this module stays cheap.
+# Only the dlib engine needs face_recognition; the OpenCV engine runs without it.
+cv2 = None
+face_recognition = None
+
+
+class DlibEncoder:
+    """Finds faces with a detectors.py backend (dlib's HOG by default) and
+    computes 128-d dlib encodings.
+
+    Holds no database state, so it can run in worker threads and processes.
+    """
+
+    kind = 'dlib'
+    dim = 128
+    # Decoded image the encodings are computed from
+    source = 'rgb'
+
+    def __init__(self, detector='hog', **detector_options):
+        global face_recognition
+        import face_recognition
+        self.detector = make_detector(detector, **detector_options)
+
+    def detect_faces(self, frame):
+        """Face locations (top, right, bottom, left) at full resolution.
+
+        The detector runs on the frame downscaled to its ``max_side``.
+        """
+        # Encoding reads colour, so a grayscale detector must not decode separately
+        frame.expect_color()
+        return [(top, right, bottom, left) for left, top, right, bottom in self.detector.detect(frame)]
+
+    def face_corners(self, location):
+        """(left, top, right, bottom) of a detected face location"""
+        top, right, bottom, left = location
+        return left, top, right, bottom
+
+    def encode_locations(self, frame, face_locations):
+        """Encodings of already-detected faces, computed at full resolution"""
+        return face_recognition.face_encodings(frame.rgb, face_locations)
+
+    def encode_faces(self, frame):
+        """Encodings of every face in the frame, computed at full resolution"""
+        face_locations = self.detect_faces(frame)
+        if not face_locations:
+            return []
+        return self.encode_locations(frame, face_locations)
+
+
+class HistogramEncoder:
+    """Detects faces (with a Haar cascade by default) and describes each one
+    by a normalized 256-bin intensity histogram (the OpenCV-only engine)."""
+
+    kind = 'histogram'
+    dim = 256
+    source = 'gray'
+
+    def __init__(self, detector='haar', **detector_options):
+        global cv2
+        import cv2
+        self.detector = make_detector(detector, **detector_options)
+
+    def detect_faces(self, frame):
+        """Face boxes (x, y, w, h) at full resolution.
+
+        The detector runs on the frame downscaled to its ``max_side``.
+        """
+        return [(left, top, right - left, bottom - top) for left, top, right, bottom in self.detector.detect(frame)]
+
+    def face_histogram(self, gray, box):
+        """Normalized intensity histogram of one face region"""
+        x, y, w, h = box
+
+        # Extract face region
+        face_roi = gray[y:y+h, x:x+w]
+
+        # Resize to standard size
+        face_roi = cv2.resize(face_roi, (100, 100))
+
+        # Calculate histogram as a simple feature
+        hist = cv2.calcHist([face_roi], [0], None, [256], [0, 256])
+        hist = hist.flatten()
+
+        # Normalize
+        return hist / (hist.sum() + 1e-7)
+
+    def face_corners(self, box):
+        """(left, top, right, bottom) of a detected face box"""
+        x, y, w, h = box
+        return x, y, x + w, y + h
+
+    def encode_locations(self, frame, faces):
+        """Histograms of already-detected face boxes"""
+        return [self.face_histogram(frame.gray, box) for box in faces]
+
+    def encode_faces(self, frame):
+        """Histograms of every face detected in the frame"""
+        # Only grayscale is needed, so colour is never decoded
+        return self.encode_locations(frame, self.detect_faces(frame))
+
+    def largest_face(self, frame):
+        """Histogram of the largest face in the frame, or None"""
+        faces = self.detect_faces(frame)
+        if len(faces) == 0:
+            return None
+        largest_face = max(faces, key=lambda x: x[2] * x[3])
+        return self.face_histogram(frame.gray, largest_face)
+
+
+ENCODERS = {
+    DlibEncoder.kind: DlibEncoder,
+    HistogramEncoder.kind: HistogramEncoder,
+}
+
+
+def make_encoder(kind, cache=None, **options):
+    """Build the encoder registered under ``kind``.
+
+    ``cache`` holds EncodingCache options (max_entries, directory,
+    max_disk_entries); the encoder is then wrapped to reuse the faces found
+    in frames it has seen before under the same ``options``.
+    """
+    if kind not in ENCODERS:
+        raise ValueError(f'Unknown face encoder: {kind}')
+    encoder = ENCODERS[kind](**options)
+    if cache:
+        encoder = CachedEncoder(encoder, EncodingCache(config_fingerprint(kind, options), **cache))
+    return encoder
@@ -0,0 +1,310 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+
+class BruteForceIndex:
+    """Exact index: every query is compared against every gallery row."""
+
+    kind = 'exact'
+
+    def build(self, matrix):
+        pass
+
+    def rebuild(self, matrix):
+        pass
+
+    def add(self, row, encoding):
+        pass
+
+    def update(self, row, encoding):
+        pass
+
+    def remove(self, row):
+        pass
+
+    def move(self, src, dst):
+        pass
+
+    def should_rebuild(self, size):
+        return False
+
+    def candidates(self, queries):
+        """Candidate gallery rows per query; None means "scan everything"."""
+        return None
+
+    def save(self, path):
+        np.savez(path, kind=self.kind)
+
+
+class IVFIndex:
+    """Approximate inverted-file index over k-means partitions.
+
+    Gallery rows are assigned to their nearest of ``nlist`` centroids, and a
+    query only scans the rows in its ``nprobe`` nearest partitions. Galleries
+    smaller than ``min_train_size`` are left untrained and scanned exactly.
+    """
+
+    kind = 'ivf'
+
+    def __init__(self, nlist=None, nprobe=8, min_train_size=2000, iterations=10, seed=0):
+        self.nlist = nlist
+        self.auto_nlist = nlist is None
+        self.nprobe = nprobe
+        self.min_train_size = min_train_size
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None
+        self.trained_size = 0
+        self._assign = np.full(0, -1, dtype=np.int32)
+        self._lists = []
+        self._list_cache = {}
+
+    @property
+    def is_trained(self):
+        return self.centroids is not None
+
+    def _nearest_centroids(self, vectors, count=1, chunk=8192):
+        """Indices of the ``count`` nearest centroids for each vector"""
+        c_sq = np.einsum('ij,ij->i', self.centroids, self.centroids)
+        nearest = np.empty((len(vectors), count), dtype=np.int32)
+        for start in range(0, len(vectors), chunk):
+            block = vectors[start:start + chunk]
+            # ||c||^2 - 2 v.c ranks centroids the same as the full distance
+            scores = c_sq[None, :] - 2.0 * (block @ self.centroids.T)
+            if count == 1:
+                nearest[start:start + chunk, 0] = np.argmin(scores, axis=1)
+            else:
+                nearest[start:start + chunk] = np.argpartition(scores, count - 1, axis=1)[:, :count]
+        return nearest
+
+    def train(self, matrix):
+        """Fit centroids with a few rounds of k-means on a sample of ``matrix``"""
+        rng = np.random.default_rng(self.seed)
+        nlist = max(1, int(4 * np.sqrt(len(matrix)))) if self.auto_nlist else self.nlist
+        nlist = min(nlist, len(matrix))
+
+        sample_size = min(len(matrix), 64 * nlist)
+        sample = matrix[rng.choice(len(matrix), sample_size, replace=False)]
+        self.centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+        for _ in range(self.iterations):
+            labels = self._nearest_centroids(sample)[:, 0]
+            counts = np.bincount(labels, minlength=nlist)
+            filled = counts > 0
+
+            # Sum each partition's members in one pass over the sorted sample
+            order = np.argsort(labels, kind='stable')
+            starts = (np.cumsum(counts) - counts)[filled]
+            sums = np.add.reduceat(sample[order], starts, axis=0)
+            self.centroids[filled] = sums / counts[filled, None]
+            # Re-seed empty partitions from random sample points
+            empty = np.flatnonzero(~filled)
+            if len(empty):
+                self.centroids[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+
+        self.nlist = nlist
+
+    def build(self, matrix):
+        """Assign every gallery row to a partition, training first if needed"""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if not self.is_trained:
+            if len(matrix) < self.min_train_size:
+                self._reset(0)
+                return
+            self.train(matrix)
+
+        self._reset(len(matrix))
+        if len(matrix):
+            self._assign[:len(matrix)] = self._nearest_centroids(matrix)[:, 0]
+            for row, partition in enumerate(self._assign[:len(matrix)]):
+                self._lists[partition].add(row)
+        self.trained_size = len(matrix)
+
+    def rebuild(self, matrix):
+        """Retrain the centroids from scratch and reassign every row"""
+        self.centroids = None
+        self.build(matrix)
+
+    def _reset(self, size):
+        self._assign = np.full(max(size, 16), -1, dtype=np.int32)
+        self._lists = [set() for _ in range(self.nlist or 0)]
+        self._list_cache = {}
+
+    def _set(self, row, partition):
+        if row >= len(self._assign):
+            grown = np.full(max(row + 1, len(self._assign) * 2), -1, dtype=np.int32)
+            grown[:len(self._assign)] = self._assign
+            self._assign = grown
+        self._assign[row] = partition
+        if partition >= 0:
+            self._lists[partition].add(row)
+            self._list_cache.pop(partition, None)
+
+    def _unset(self, row):
+        partition = self._assign[row] if row < len(self._assign) else -1
+        if partition >= 0:
+            self._lists[partition].discard(row)
+            self._list_cache.pop(partition, None)
+            self._assign[row] = -1
+        return partition
+
+    def add(self, row, encoding):
+        if self.is_trained:
+            vector = np.asarray(encoding, dtype=np.float32).reshape(1, -1)
+            self._set(row, self._nearest_centroids(vector)[0, 0])
+
+    def update(self, row, encoding):
+        self._unset(row)
+        self.add(row, encoding)
+
+    def remove(self, row):
+        self._unset(row)
+
+    def move(self, src, dst):
+        """Row ``src`` now lives at ``dst`` (the gallery swapped it in)"""
+        self._unset(dst)
+        self._set(dst, self._unset(src))
+
+    def should_rebuild(self, size):
+        """Retrain once the gallery has grown well past the training size"""
+        if not self.is_trained:
+            return size >= self.min_train_size
+        return size > 4 * max(self.trained_size, 1)
+
+    def _partition_rows(self, partition):
+        rows = self._list_cache.get(partition)
+        if rows is None:
+            rows = np.fromiter(self._lists[partition], dtype=np.int64, count=len(self._lists[partition]))
+            self._list_cache[partition] = rows
+        return rows
+
+    def candidates(self, queries):
+        if not self.is_trained:
+            return None
+        nprobe = min(self.nprobe, self.nlist)
+        probes = self._nearest_centroids(np.asarray(queries, dtype=np.float32), nprobe)
+        return [
+            np.concatenate([self._partition_rows(partition) for partition in query_probes])
+            for query_probes in probes
+        ]
+
+    def save(self, path):
+        """Persist the trained centroids; row assignment is rebuilt on load"""
+        np.savez(
+            path,
+            kind=self.kind,
+            centroids=self.centroids if self.is_trained else np.zeros((0, 0), dtype=np.float32),
+            params=np.array([self.nlist or 0, self.nprobe, self.min_train_size, self.iterations,
+                             self.seed, int(self.auto_nlist)]),
+        )
+
+    @classmethod
+    def from_saved(cls, data):
+        nlist, nprobe, min_train_size, iterations, seed, auto_nlist = (int(value) for value in data['params'])
+        index = cls(nlist=nlist or None, nprobe=nprobe, min_train_size=min_train_size,
+                    iterations=iterations, seed=seed)
+        index.auto_nlist = bool(auto_nlist)
+        if data['centroids'].size:
+            index.centroids = data['centroids'].astype(np.float32)
+        return index
+
+
+INDEX_TYPES = {
+    BruteForceIndex.kind: BruteForceIndex,
+    IVFIndex.kind: IVFIndex,
+}
+
+
+def load_index(path):
+    """Load an index saved with ``save``"""
+    with np.load(path) as data:
+        kind = str(data['kind'])
+        if kind == IVFIndex.kind:
+            return IVFIndex.from_saved(data)
+        return INDEX_TYPES[kind]()
+
+
+def make_index(kind='exact', path=None, **options):
+    """Build an index of the given kind, reusing a saved one at ``path`` if present"""
+    if path and os.path.exists(path):
+        try:
+            index = load_index(path)
+            if index.kind == kind:
+                # Runtime knobs such as nprobe come from config, not the file
+                for name, value in options.items():
+                    setattr(index, name, value)
+                return index
+        except Exception as e:
+            print(f"Error loading face index from {path}: {e}")
+
+    if kind not in INDEX_TYPES:
+        raise ValueError(f'Unknown face index type: {kind}')
+    return INDEX_TYPES[kind](**options)
+
+
+def synthetic_gallery(size, dim=128, noise=0.05, queries=200, seed=0):
+    """Random unit-norm identities plus noisy probes of known identities"""
+    rng = np.random.default_rng(seed)
+    gallery = rng.normal(size=(size, dim)).astype(np.float32)
+    gallery /= np.linalg.norm(gallery, axis=1, keepdims=True)
+    truth = rng.choice(size, queries, replace=False)
+    probes = gallery[truth] + rng.normal(scale=noise, size=(queries, dim)).astype(np.float32)
+    return gallery, probes.astype(np.float32), truth
+
+
+def recall_report(sizes=(10000, 100000), nprobes=(1, 4, 8, 16, 32), queries=200):
+    """Recall@1 and per-query latency of IVF against the exact backend"""
+    from gallery import FaceGallery
+
+    report = []
+    for size in sizes:
+        matrix, probes, _ = synthetic_gallery(size, queries=queries)
+
+        exact = FaceGallery(dim=matrix.shape[1])
+        exact.load([str(i) for i in range(size)], matrix)
+        start = time.perf_counter()
+        expected = [candidates[0][0] for candidates in exact.match(probes, tolerance=10.0)]
+        exact_ms = (time.perf_counter() - start) * 1000 / queries
+        report.append({'size': size, 'index': 'exact', 'nprobe': None,
+                       'recall': 1.0, 'ms_per_query': round(exact_ms, 3)})
+
+        index = IVFIndex()
+        approx = FaceGallery(dim=matrix.shape[1], index=index)
+        start = time.perf_counter()
+        approx.load([str(i) for i in range(size)], matrix)
+        build_s = time.perf_counter() - start
+
+        for nprobe in nprobes:
+            index.nprobe = nprobe
+            start = time.perf_counter()
+            found = [candidates[0][0] if candidates else None
+                     for candidates in approx.match(probes, tolerance=10.0)]
+            approx_ms = (time.perf_counter() - start) * 1000 / queries
+            recall = float(np.mean([a == b for a, b in zip(found, expected)]))
+            report.append({'size': size, 'index': 'ivf', 'nprobe': nprobe, 'nlist': index.nlist,
+                           'build_s': round(build_s, 2), 'recall': recall,
+                           'ms_per_query': round(approx_ms, 3)})
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recall vs latency of the approximate face index')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--json', help='Also write the report to this file')
+    args = parser.parse_args()
+
+    rows = recall_report(args.sizes, args.nprobe, args.queries)
+    print(f"{'size':>8} {'index':>6} {'nprobe':>6} {'recall':>7} {'ms/query':>9}")
+    for row in rows:
+        print(f"{row['size']:>8} {row['index']:>6} {str(row['nprobe'] or '-'):>6} "
+              f"{row['recall']:>7.3f} {row['ms_per_query']:>9.3f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
@@ -0,0 +1,576 @@
+import glob
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from face_index import BruteForceIndex
+
+# Snapshot row and norm files no sidecar names are removed once they are
+# this many seconds old: by then no save that wrote them is still running
+ORPHAN_SNAPSHOT_AGE = 600
+
+
+def _fit_strings(array, values):
+    """``array``, widened if it is fixed-width text too narrow for ``values``.
+
+    The database does not enforce String(n) lengths, so ids and columns
+    grow to fit rather than silently truncating.
+    """
+    if array.dtype.kind != 'U':
+        return array
+    width = max((len(str(value)) for value in values), default=0)
+    if width <= array.dtype.itemsize // 4:
+        return array
+    return array.astype(f'<U{width}')
+
+
+def _snapshot_files(path):
+    """Row and norm files named by the snapshot sidecar at ``path``, if any"""
+    try:
+        with np.load(f'{path}.npz') as sidecar:
+            names = [str(sidecar[key]) for key in ('matrix_file', 'norms_file') if key in sidecar.files]
+    except (OSError, ValueError):
+        return []
+    directory = os.path.dirname(path)
+    return [os.path.join(directory, name) for name in names]
+
+
+class ReadWriteLock:
+    """Any number of readers or a single writer. Waiting writers block new
+    readers, so a steady stream of matches cannot starve a roster change.
+    Not reentrant."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def reading(self):
+        with self._condition:
+            while self._writing or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._condition:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class FaceGallery:
+    """In-memory gallery of enrolled face encodings.
+
+    All encodings live in one preallocated, contiguous float32 matrix
+    (capacity x dim) with a parallel array of student ids, so every face
+    detected in a frame is matched against the whole gallery in a single
+    vectorized distance computation.
+
+    Every change bumps ``version`` and is kept in a bounded change log, so a
+    consumer holding an older copy can apply only the changes since its own
+    version via ``changes_since`` / ``apply_changes``.
+
+    Candidate selection is delegated to a pluggable index (see face_index);
+    the default brute-force index scans every row exactly.
+
+    With ``metric='correlation'`` rows are stored mean-centered and
+    L2-normalized, so Pearson correlation against the whole gallery is a
+    single matrix multiply; distances are then ``1 - correlation``.
+
+    Optional metadata ``columns`` (name -> numpy dtype) are stored parallel
+    to the matrix. When ``class_name`` and ``section`` are among them the
+    gallery also keeps the rows of every class/section, so a scoped match
+    only touches that section's rows.
+
+    Request and job threads share one gallery: matches and other reads hold
+    ``lock`` for reading, changes hold it for writing, so a match never sees
+    a half-written row or a scope group being changed.
+    """
+
+    def __init__(self, dim=128, capacity=1024, max_changes=10000, index=None, columns=None,
+                 metric='euclidean'):
+        if metric not in ('euclidean', 'correlation'):
+            raise ValueError(f'Unknown gallery metric: {metric}')
+        self.dim = dim
+        self.metric = metric
+        self.index = index if index is not None else BruteForceIndex()
+        self.column_types = dict(columns or {})
+        self.size = 0
+        self.version = 0
+        self._row_of = {}
+        self._changes = deque(maxlen=max_changes)
+        self._log_base = 0
+        self._matrix = np.zeros((capacity, dim), dtype=np.float32)
+        self._sq_norms = np.zeros(capacity, dtype=np.float32)
+        self._ids = np.empty(capacity, dtype='<U20')
+        self._columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in self.column_types.items()}
+        self._scoped = 'class_name' in self._columns and 'section' in self._columns
+        self._groups = {}
+        self._scope_cache = {}
+        self.lock = ReadWriteLock()
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self):
+        return self._matrix.shape[0]
+
+    @property
+    def matrix(self):
+        """View of the filled rows of the encoding matrix"""
+        return self._matrix[:self.size]
+
+    @property
+    def ids(self):
+        """View of the student ids, parallel to ``matrix``"""
+        return self._ids[:self.size]
+
+    def column(self, name):
+        """View of a metadata column, parallel to ``matrix``"""
+        return self._columns[name][:self.size]
+
+    def metadata(self, student_id):
+        """Metadata column values of a student's row, or None if not enrolled"""
+        with self.lock.reading():
+            row = self._row_of.get(student_id)
+            if row is None:
+                return None
+            return {name: str(values[row]) for name, values in self._columns.items()}
+
+    def _reserve(self, capacity):
+        """Grow the backing arrays so they hold at least ``capacity`` rows"""
+        if capacity <= self.capacity:
+            return
+        self._reallocate(max(capacity, self.capacity * 2, 16))
+
+    def _ensure_writable(self):
+        """Copy adopted read-only (e.g. shared-memory) arrays before the first write"""
+        if not self._matrix.flags.writeable:
+            self._reallocate(max(self.capacity, 16))
+
+    def _reallocate(self, new_capacity):
+        matrix = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        sq_norms = np.zeros(new_capacity, dtype=np.float32)
+        ids = np.empty(new_capacity, dtype=self._ids.dtype)
+
+        matrix[:self.size] = self._matrix[:self.size]
+        sq_norms[:self.size] = self._sq_norms[:self.size]
+        ids[:self.size] = self._ids[:self.size]
+        for name, values in self._columns.items():
+            grown = np.empty(new_capacity, dtype=values.dtype)
+            grown[:self.size] = values[:self.size]
+            self._columns[name] = grown
+
+        self._matrix, self._sq_norms, self._ids = matrix, sq_norms, ids
+
+    def _prepare(self, encodings):
+        """Cast encodings to float32 rows, centering and normalizing them for
+        the correlation metric"""
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        if self.metric == 'correlation':
+            encodings = encodings - encodings.mean(axis=1, keepdims=True)
+            norms = np.linalg.norm(encodings, axis=1, keepdims=True)
+            encodings /= np.maximum(norms, 1e-12)
+        return encodings
+
+    def load(self, student_ids, encodings, version=0, metadata=None):
+        """Replace the gallery contents with the given ids and encodings.
+
+        ``metadata`` maps column names to sequences parallel to ``student_ids``.
+        """
+        encodings = self._prepare(encodings)
+        if len(student_ids) != len(encodings):
+            raise ValueError('student_ids and encodings must have the same length')
+        with self.lock.writing():
+            self._load(student_ids, encodings, version, metadata)
+
+    def _load(self, student_ids, encodings, version, metadata):
+        self.size = 0
+        self._reserve(len(encodings))
+        self.size = len(encodings)
+        self._matrix[:self.size] = encodings
+        self._sq_norms[:self.size] = np.einsum('ij,ij->i', encodings, encodings)
+        self._ids = _fit_strings(self._ids, student_ids)
+        self._ids[:self.size] = student_ids
+        self._row_of = {student_id: row for row, student_id in enumerate(student_ids)}
+        for name, values in (metadata or {}).items():
+            self._columns[name] = _fit_strings(self._columns[name], values)
+            self._columns[name][:self.size] = values
+        self._rebuild_groups()
+        self.index.build(self.matrix)
+
+        self.version = version
+        self._changes.clear()
+        self._log_base = version
+
+    def adopt(self, student_ids, matrix, version=0, metadata=None, sq_norms=None):
+        """Use existing arrays as the gallery without copying them.
+
+        Meant for read-only views such as a shared-memory snapshot: rows must
+        already be prepared for this gallery's metric. The arrays are only
+        copied if the gallery is later changed. Squared row norms are
+        computed from ``matrix`` (reading all of it) unless ``sq_norms`` is
+        given.
+        """
+        with self.lock.writing():
+            self._adopt(student_ids, matrix, version, metadata, sq_norms)
+
+    def _adopt(self, student_ids, matrix, version, metadata, sq_norms):
+        self.size = len(matrix)
+        self._matrix = matrix
+        self._ids = student_ids
+        self._sq_norms = sq_norms if sq_norms is not None else np.einsum('ij,ij->i', matrix, matrix)
+        for name in self._columns:
+            self._columns[name] = (metadata or {})[name]
+        self._row_of = {str(student_id): row for row, student_id in enumerate(student_ids)}
+        self._rebuild_groups()
+        self.index.build(self.matrix)
+
+        self.version = version
+        self._changes.clear()
+        self._log_base = version
+
+    def save_snapshot(self, path, signature=''):
+        """Persist the gallery for ``open_snapshot``.
+
+        Rows and their squared norms go to ``.npy`` files that later starts
+        can memory-map; ids, metadata columns, version and ``signature`` go
+        to the ``path.npz`` sidecar that names them. All are replaced
+        atomically.
+        """
+        with self.lock.reading():
+            self._save_snapshot(path, signature)
+
+    def _save_snapshot(self, path, signature):
+        token = uuid.uuid4().hex[:12]
+        matrix_path = f'{path}.{token}.npy'
+        norms_path = f'{path}.{token}.norms.npy'
+        for file_path, array in ((matrix_path, self.matrix), (norms_path, self._sq_norms[:self.size])):
+            with open(file_path + '.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(file_path + '.tmp', file_path)
+
+        # Only the files of the snapshot being replaced are removed afterwards:
+        # another process may be writing its own snapshot files right now
+        replaced = _snapshot_files(path)
+        sidecar_tmp = f'{path}.{token}.tmp'
+        with open(sidecar_tmp, 'wb') as f:
+            np.savez(
+                f,
+                ids=self.ids,
+                version=self.version,
+                signature=np.array(signature),
+                metric=np.array(self.metric),
+                dim=self.dim,
+                matrix_file=np.array(os.path.basename(matrix_path)),
+                norms_file=np.array(os.path.basename(norms_path)),
+                **{f'column_{name}': self.column(name) for name in self.column_types}
+            )
+        os.replace(sidecar_tmp, f'{path}.npz')
+
+        # Saves racing this one may leave files nobody names; sweep old ones
+        current = set(_snapshot_files(path))
+        cutoff = time.time() - ORPHAN_SNAPSHOT_AGE
+        for old_path in glob.glob(glob.escape(path) + '.*.npy'):
+            if old_path in current or old_path in (matrix_path, norms_path):
+                continue
+            try:
+                if old_path in replaced or os.path.getmtime(old_path) < cutoff:
+                    os.remove(old_path)
+            except OSError:
+                pass
+
+    def open_snapshot(self, path, signature=''):
+        """Adopt a snapshot written by ``save_snapshot`` if it matches ``signature``.
+
+        The rows and their norms are memory-mapped read-only, so startup does
+        not read them up front and processes mapping the same files share
+        their pages. Returns
+        False, leaving the gallery untouched, when the snapshot is missing,
+        stale or was written for another metric or dimension.
+        """
+        if not os.path.exists(f'{path}.npz'):
+            return False
+        try:
+            with np.load(f'{path}.npz') as sidecar:
+                if (str(sidecar['signature']) != signature or str(sidecar['metric']) != self.metric
+                        or int(sidecar['dim']) != self.dim
+                        or 'norms_file' not in sidecar.files
+                        or any(f'column_{name}' not in sidecar.files for name in self.column_types)):
+                    return False
+                student_ids = sidecar['ids']
+                version = int(sidecar['version'])
+                metadata = {name: sidecar[f'column_{name}'] for name in self.column_types}
+                matrix_file = str(sidecar['matrix_file'])
+                norms_file = str(sidecar['norms_file'])
+            directory = os.path.dirname(path)
+            matrix = np.load(os.path.join(directory, matrix_file), mmap_mode='r')
+            sq_norms = np.load(os.path.join(directory, norms_file), mmap_mode='r')
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Error opening gallery snapshot {path}: {e}")
+            return False
+
+        if (matrix.shape != (len(student_ids), self.dim) or matrix.dtype != np.float32
+                or sq_norms.shape != (len(student_ids),)):
+            return False
+        self.adopt(student_ids, matrix, version=version, metadata=metadata, sq_norms=sq_norms)
+        return True
+
+    def _log_change(self, operation, student_id, encoding, metadata, version):
+        self.version = self.version + 1 if version is None else version
+        if len(self._changes) == self._changes.maxlen:
+            self._log_base = self._changes[0][0]
+        self._changes.append((self.version, operation, student_id, encoding, metadata))
+
+    def _group_key(self, row):
+        return (str(self._columns['class_name'][row]), str(self._columns['section'][row]))
+
+    def _rebuild_groups(self):
+        self._groups = {}
+        self._scope_cache = {}
+        if self._scoped:
+            for row in range(self.size):
+                self._groups.setdefault(self._group_key(row), set()).add(row)
+
+    def _ungroup_row(self, row):
+        if self._scoped:
+            self._groups.get(self._group_key(row), set()).discard(row)
+            self._scope_cache = {}
+
+    def _group_row(self, row):
+        if self._scoped:
+            self._groups.setdefault(self._group_key(row), set()).add(row)
+            self._scope_cache = {}
+
+    def _write_row(self, row, student_id, encoding, metadata):
+        self._ensure_writable()
+        self._matrix[row] = encoding
+        self._sq_norms[row] = encoding @ encoding
+        self._ids = _fit_strings(self._ids, [student_id])
+        self._ids[row] = student_id
+        for name, value in metadata.items():
+            self._columns[name] = _fit_strings(self._columns[name], [value])
+            self._columns[name][row] = value
+        self._row_of[student_id] = row
+
+    def _row_metadata(self, row):
+        return {name: values[row] for name, values in self._columns.items()}
+
+    def add(self, student_id, encoding, version=None, metadata=None):
+        """Add a student's encoding, replacing any existing row for that id"""
+        with self.lock.writing():
+            self._add(student_id, encoding, version, metadata)
+
+    def _add(self, student_id, encoding, version, metadata):
+        encoding = self._prepare(encoding)[0]
+        # Columns this gallery does not keep are ignored
+        metadata = {name: value for name, value in (metadata or {}).items() if name in self._columns}
+        row = self._row_of.get(student_id)
+        if row is None:
+            self._reserve(self.size + 1)
+            row = self.size
+            self.size += 1
+            self._write_row(row, student_id, encoding, metadata)
+            self.index.add(row, encoding)
+        else:
+            self._ungroup_row(row)
+            self._write_row(row, student_id, encoding, metadata)
+            self.index.update(row, encoding)
+        self._group_row(row)
+        self._log_change('add', student_id, encoding, metadata, version)
+
+        if self.index.should_rebuild(self.size):
+            self.index.rebuild(self.matrix)
+
+    def update(self, student_id, encoding, version=None, metadata=None):
+        """Overwrite a student's row in place (adds it if missing)"""
+        self.add(student_id, encoding, version=version, metadata=metadata)
+
+    def remove(self, student_id, version=None):
+        """Remove a student's row by moving the last row into its slot"""
+        with self.lock.writing():
+            self._remove(student_id, version)
+
+    def _remove(self, student_id, version):
+        row = self._row_of.pop(student_id, None)
+        if row is not None:
+            last = self.size - 1
+            self.index.remove(row)
+            self._ungroup_row(row)
+            if row != last:
+                self._ungroup_row(last)
+                self._write_row(row, str(self._ids[last]), self._matrix[last].copy(), self._row_metadata(last))
+                self._group_row(row)
+                self.index.move(last, row)
+            self.size = last
+        self._log_change('remove', student_id, None, None, version)
+
+    def changes_since(self, version):
+        """Changes newer than ``version`` as ``(version, operation, student_id,
+        encoding, metadata)`` tuples, or None if the log no longer reaches back that far
+        and the caller has to reload the whole gallery."""
+        with self.lock.reading():
+            if version >= self.version:
+                return []
+            if version < self._log_base:
+                return None
+            return [change for change in self._changes if change[0] > version]
+
+    def apply_changes(self, changes):
+        """Apply changes produced by another gallery's ``changes_since``"""
+        with self.lock.writing():
+            for version, operation, student_id, encoding, metadata in changes:
+                if operation == 'remove':
+                    self._remove(student_id, version)
+                else:
+                    self._add(student_id, encoding, version, metadata)
+
+    def scope_rows(self, class_name, section=None):
+        """Gallery rows of one class (optionally one section), cached until
+        the roster changes"""
+        if not self._scoped:
+            raise ValueError('This gallery has no class_name/section columns')
+        key = (class_name, section)
+        rows = self._scope_cache.get(key)
+        if rows is None:
+            members = set()
+            for (group_class, group_section), group_rows in self._groups.items():
+                if group_class == class_name and section in (None, group_section):
+                    members |= group_rows
+            rows = np.array(sorted(members), dtype=np.int64)
+            self._scope_cache[key] = rows
+        return rows
+
+    def _distances_to(self, queries, rows=None):
+        """Distances from each (prepared) query to the given gallery rows"""
+        if rows is None:
+            matrix = self.matrix
+            sq_norms = self._sq_norms[:self.size]
+        else:
+            matrix = self._matrix[rows]
+            sq_norms = self._sq_norms[rows]
+        if len(matrix) == 0 or len(queries) == 0:
+            return np.zeros((len(queries), len(matrix)), dtype=np.float32)
+
+        if self.metric == 'correlation':
+            # Rows and queries are centered unit vectors: q.g is Pearson's r
+            distances = queries @ matrix.T
+            np.subtract(1.0, distances, out=distances)
+            return distances
+
+        # ||q - g||^2 = ||q||^2 + ||g||^2 - 2 q.g, computed as one matrix multiply
+        q_sq = np.einsum('ij,ij->i', queries, queries)
+        d2 = queries @ matrix.T
+        d2 *= -2.0
+        d2 += q_sq[:, None]
+        d2 += sq_norms[None, :]
+        np.maximum(d2, 0.0, out=d2)
+        return np.sqrt(d2, out=d2)
+
+    def distances(self, encodings):
+        """Distances between query encodings and every gallery row.
+
+        Returns a (faces x gallery) float32 matrix.
+        """
+        queries = self._prepare(encodings)
+        with self.lock.reading():
+            return self._distances_to(queries)
+
+    def _top_k(self, distances, rows, top_k, tolerance):
+        """Closest ``top_k`` (student_id, distance) pairs within tolerance"""
+        if len(distances) == 0:
+            return []
+        k = min(top_k, len(distances))
+        if k == 1:
+            nearest = [int(np.argmin(distances))]
+        else:
+            nearest = np.argpartition(distances, k - 1)[:k]
+            nearest = nearest[np.argsort(distances[nearest])]
+
+        matches = []
+        for column in nearest:
+            if distances[column] <= tolerance:
+                row = column if rows is None else rows[column]
+                matches.append((str(self._ids[row]), float(distances[column])))
+        return matches
+
+    def best_matches(self, encodings, tolerance=0.6, class_name=None, section=None, fallback=True):
+        """Closest ``(student_id, distance)`` per query within tolerance, or None.
+
+        With a class/section scope, queries unmatched in scope are retried
+        against the whole gallery when ``fallback`` is set.
+        """
+        with self.lock.reading():
+            return self._best_matches(encodings, tolerance, class_name, section, fallback)
+
+    def _best_matches(self, encodings, tolerance, class_name, section, fallback):
+        if not class_name:
+            return [candidates[0] if candidates else None
+                    for candidates in self._match(encodings, tolerance)]
+
+        scoped = self._match(encodings, tolerance, class_name=class_name, section=section or None)
+        best = [candidates[0] if candidates else None for candidates in scoped]
+
+        missing = [i for i, match in enumerate(best) if match is None]
+        if missing and fallback:
+            retried = self._match([encodings[i] for i in missing], tolerance)
+            for i, candidates in zip(missing, retried):
+                best[i] = candidates[0] if candidates else None
+        return best
+
+    def match(self, encodings, tolerance=0.6, top_k=1, class_name=None, section=None):
+        """Match every query encoding against the gallery.
+
+        Returns one list per query of up to ``top_k`` ``(student_id, distance)``
+        pairs within ``tolerance``, closest first. Passing ``class_name``
+        (and optionally ``section``) restricts the search to those rows.
+        """
+        with self.lock.reading():
+            return self._match(encodings, tolerance, top_k, class_name, section)
+
+    def _match(self, encodings, tolerance=0.6, top_k=1, class_name=None, section=None):
+        queries = self._prepare(encodings)
+        if self.size == 0:
+            return [[] for _ in range(len(queries))]
+
+        if class_name is not None:
+            # Sections are small, so scoped lookups scan their rows exactly
+            rows = self.scope_rows(class_name, section)
+            distances = self._distances_to(queries, rows)
+            return [self._top_k(row, rows, top_k, tolerance) for row in distances]
+
+        candidates = self.index.candidates(queries)
+        if candidates is None:
+            # Exact search: one (faces x gallery) distance matrix for the frame
+            distances = self._distances_to(queries)
+            return [self._top_k(row, None, top_k, tolerance) for row in distances]
+
+        results = []
+        for query, rows in zip(queries, candidates):
+            distances = self._distances_to(query[None, :], rows)[0]
+            results.append(self._top_k(distances, rows, top_k, tolerance))
+        return results
@@ -0,0 +1,165 @@
+import base64
+
+import numpy as np
+
+# OpenCV is imported on the first decode, so request parsing (and every
+# route that never touches an image) does not pay for it
+cv2 = None
+
+
+def load_cv2():
+    """Import OpenCV on first use; None when it is not installed (demo app)"""
+    global cv2
+    if cv2 is None:
+        try:
+            import cv2
+        except ImportError:
+            return None
+    return cv2
+
+
+def request_data(req):
+    """Form fields of a JSON, multipart or raw-image request as a plain dict.
+
+    Raw ``image/jpeg`` bodies carry their fields in the query string.
+    """
+    if req.is_json:
+        return req.get_json(silent=True) or {}
+    if req.mimetype in ('multipart/form-data', 'application/x-www-form-urlencoded'):
+        return req.form.to_dict()
+    return req.args.to_dict()
+
+
+def request_flag(req, name, data=None):
+    """Whether a yes/no option is set, from the query string or the request
+    fields. JSON ``true``/``1`` and the strings 1/true/yes/on count as set."""
+    value = req.args.get(name)
+    if value is None:
+        value = (data or {}).get(name)
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return value is True or (isinstance(value, int) and value == 1)
+
+
+def decode_base64_image(image_data):
+    """Bytes of a base64 image, with or without a ``data:image/...`` prefix"""
+    if isinstance(image_data, str) and image_data.startswith('data:image'):
+        image_data = image_data.split(',', 1)[1]
+    return base64.b64decode(image_data)
+
+
+def request_image_bytes(req, field, data=None):
+    """Encoded image bytes posted under ``field``.
+
+    Accepts a multipart file part, a raw ``image/*`` request body, or (for
+    older clients) a base64 data URL inside the JSON/form fields.
+    """
+    if field in req.files:
+        return req.files[field].read()
+    if req.mimetype.startswith('image/'):
+        return req.get_data(cache=False)
+
+    image_data = (data or {}).get(field)
+    if image_data:
+        return decode_base64_image(image_data)
+    return None
+
+
+def request_image_list(req, field, data=None):
+    """Encoded image bytes of every frame posted under ``field``.
+
+    Accepts repeated multipart file parts or a JSON list of base64 data URLs.
+    """
+    files = req.files.getlist(field)
+    if files:
+        return [f.read() for f in files]
+
+    images = (data or {}).get(field) or []
+    if isinstance(images, str):
+        images = [images]
+    return [decode_base64_image(image_data) for image_data in images if image_data]
+
+
+def decode_image(image_bytes, grayscale=False):
+    """Decode JPEG/PNG bytes straight from the buffer into a BGR (or gray) array"""
+    load_cv2()
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    flags = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    image = cv2.imdecode(buffer, flags)
+    if image is None:
+        raise ValueError('Could not decode image')
+    return image
+
+
+class Frame:
+    """One uploaded image, decoded at most once and shared by detection,
+    encoding and persistence.
+
+    Detection can run on a copy downscaled so its longest side is at most
+    ``max_side`` pixels; ``to_full_resolution`` maps the boxes found there
+    back onto the full-resolution image used for encoding.
+
+    ``gray`` decodes straight to grayscale unless colour is needed as well
+    (``color``, or ``expect_color`` called before the first read); it is
+    then derived from the one colour decode.
+    """
+
+    def __init__(self, image_bytes, max_side=None, color=False):
+        self.image_bytes = image_bytes
+        self.max_side = max_side
+        self.color = color
+        self._bgr = None
+        self._rgb = None
+        self._gray = None
+
+    @property
+    def bgr(self):
+        if self._bgr is None:
+            self._bgr = decode_image(self.image_bytes)
+        return self._bgr
+
+    @property
+    def rgb(self):
+        if self._rgb is None:
+            # Decode first: that is what imports OpenCV
+            bgr = self.bgr
+            self._rgb = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+        return self._rgb
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            if self._bgr is not None or self.color:
+                bgr = self.bgr
+                self._gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+            else:
+                # Nothing needs colour yet, so skip the colour decode entirely
+                self._gray = decode_image(self.image_bytes, grayscale=True)
+        return self._gray
+
+    def expect_color(self):
+        """Note that colour will be read, so ``gray`` comes from the colour decode"""
+        self.color = True
+
+    def for_detection(self, image):
+        """``image`` downscaled to ``max_side`` for detection, plus the scale used"""
+        height, width = image.shape[:2]
+        if not self.max_side or max(height, width) <= self.max_side:
+            return image, 1.0
+        scale = self.max_side / max(height, width)
+        size = (max(1, round(width * scale)), max(1, round(height * scale)))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA), scale
+
+    def to_full_resolution(self, boxes, scale):
+        """Scale boxes found on a downscaled image back to full resolution"""
+        if scale == 1.0:
+            return [tuple(int(v) for v in box) for box in boxes]
+        return [tuple(int(round(v / scale)) for v in box) for box in boxes]
+
+    def save(self, path):
+        """Write the image to ``path``, reusing the uploaded bytes for JPEGs"""
+        if self.image_bytes[:2] == b'\xff\xd8' or load_cv2() is None:
+            with open(path, 'wb') as f:
+                f.write(self.image_bytes)
+        else:
+            cv2.imwrite(path, self.bgr)
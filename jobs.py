@@ -0,0 +1,219 @@
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from events import sse_message
+
+
+class JobQueueFull(Exception):
+    """Too many jobs are already waiting; the client should retry later"""
+
+
+def job_owner():
+    """Identifies the process running a job, as ``host:pid``"""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def owner_gone(owner):
+    """Whether the process that claimed a job has certainly exited: it
+    is this process (which has claimed nothing before ``start``) or a
+    process on this host that no longer exists. None when that cannot be
+    told: the owner is on another host, or the platform has no cheap
+    liveness check."""
+    if owner is None:
+        # Claimed before owners were recorded
+        return True
+    host, _, pid = owner.rpartition(':')
+    if host != socket.gethostname() or not pid.isdigit():
+        return None
+    if int(pid) == os.getpid():
+        return True
+    if os.name != 'posix':
+        # os.kill would terminate the process on Windows
+        return None
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except OSError:
+        # e.g. PermissionError: it exists but belongs to another user
+        pass
+    return False
+
+
+class JobQueue:
+    """Bounded background queue of jobs persisted in a database table.
+
+    A job's input and parameters are stored with it, so queued jobs
+    survive a restart and are picked up again by ``start``, along with
+    running jobs whose process has exited. Each claimed job records its
+    process (``job_owner``); jobs claimed on another host, whose process
+    cannot be checked, are requeued once they have run for ``stale_after``
+    seconds. ``handler``
+    is called as ``handler(payload, params)`` in an app context and
+    returns a JSON-serializable result. Jobs raising one of ``retry_on``
+    go back into the queue and are retried after ``retry_delay`` seconds.
+    ``notifier`` (an events.EventNotifier) is woken whenever a job finishes.
+    """
+
+    def __init__(self, app, db, Job, handler, workers=2, max_queued=64, retry_on=(), retry_delay=1,
+                 stale_after=300, keep_for=86400, notifier=None):
+        self.app = app
+        self.db = db
+        self.Job = Job
+        self.handler = handler
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+        self.max_queued = max_queued
+        self.retry_on = tuple(retry_on)
+        self.retry_delay = retry_delay
+        self.stale_after = stale_after
+        self.keep_for = keep_for
+        self.notifier = notifier
+        self.started = False
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Resume jobs left over from an earlier run (once per process) and
+        drop finished jobs older than ``keep_for`` seconds"""
+        if self.started:
+            return
+        with self.lock:
+            if self.started:
+                return
+            Job, session = self.Job, self.db.session
+            with self.app.app_context():
+                try:
+                    now = datetime.utcnow()
+                    stale = now - timedelta(seconds=self.stale_after)
+                    orphaned = []
+                    for job_id, owner, started_at in session.query(Job.id, Job.owner, Job.started_at).filter(
+                            Job.status == 'running'):
+                        gone = owner_gone(owner)
+                        if gone or (gone is None and (started_at is None or started_at < stale)):
+                            orphaned.append(job_id)
+                    # The claim in _run stops a requeued job from running twice
+                    if orphaned:
+                        session.query(Job).filter(Job.id.in_(orphaned), Job.status == 'running').update(
+                            {Job.status: 'queued', Job.owner: None}, synchronize_session=False
+                        )
+                    session.query(Job).filter(
+                        Job.status.in_(('done', 'failed')), Job.finished_at < now - timedelta(seconds=self.keep_for)
+                    ).delete(synchronize_session=False)
+                    session.commit()
+                    queued = [job_id for (job_id,) in session.query(Job.id).filter(Job.status == 'queued')
+                              .order_by(Job.created_at)]
+                except Exception as e:
+                    # e.g. the table does not exist yet; the next submit or poll retries
+                    session.rollback()
+                    print(f"Error resuming queued jobs: {e}")
+                    return
+            self.started = True
+            for job_id in queued:
+                self.executor.submit(self._run, job_id)
+
+    def pending(self):
+        return self.db.session.query(self.Job.id).filter(self.Job.status.in_(('queued', 'running'))).count()
+
+    def submit(self, payload, params):
+        """Queue a job and return its id; raises JobQueueFull when
+        ``max_queued`` jobs are already waiting or running"""
+        self.start()
+        if self.pending() >= self.max_queued:
+            raise JobQueueFull(f'{self.max_queued} jobs already queued')
+        job = self.Job(id=uuid.uuid4().hex, status='queued', payload=payload, params=json.dumps(params))
+        self.db.session.add(job)
+        self.db.session.commit()
+        self.executor.submit(self._run, job.id)
+        return job.id
+
+    def get(self, job_id):
+        """Public view of a job, or None if it does not exist"""
+        job = self.db.session.get(self.Job, job_id)
+        if job is None:
+            return None
+        return {
+            'id': job.id,
+            'status': job.status,
+            'created_at': job.created_at.strftime('%Y-%m-%d %H:%M:%S') if job.created_at else None,
+            'finished_at': job.finished_at.strftime('%Y-%m-%d %H:%M:%S') if job.finished_at else None,
+            'result': json.loads(job.result) if job.result else None,
+            'error': job.error
+        }
+
+    def _run(self, job_id):
+        Job = self.Job
+        with self.app.app_context():
+            session = self.db.session
+            # Claim the job; another process may have resumed it already
+            claimed = session.query(Job).filter(Job.id == job_id, Job.status == 'queued').update(
+                {Job.status: 'running', Job.started_at: datetime.utcnow(), Job.owner: job_owner()},
+                synchronize_session=False
+            )
+            session.commit()
+            if not claimed:
+                return
+
+            job = session.get(Job, job_id)
+            payload, params = job.payload, json.loads(job.params)
+            session.rollback()
+            try:
+                result = self.handler(payload, params)
+            except self.retry_on:
+                session.rollback()
+                session.query(Job).filter(Job.id == job_id).update({Job.status: 'queued'}, synchronize_session=False)
+                session.commit()
+                threading.Timer(self.retry_delay, self.executor.submit, (self._run, job_id)).start()
+                return
+            except Exception as e:
+                print(f"Error running job {job_id}: {e}")
+                session.rollback()
+                self._finish(job_id, 'failed', error=str(e)[:200])
+            else:
+                self._finish(job_id, 'done', result=json.dumps(result))
+
+        if self.notifier is not None:
+            self.notifier.notify()
+
+    def _finish(self, job_id, status, result=None, error=None):
+        Job, session = self.Job, self.db.session
+        # The input is not kept once it has been processed
+        session.query(Job).filter(Job.id == job_id).update({
+            Job.status: status,
+            Job.result: result,
+            Job.error: error,
+            Job.payload: None,
+            Job.finished_at: datetime.utcnow()
+        }, synchronize_session=False)
+        session.commit()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+def job_event_stream(jobs, job_id, notifier, poll_interval=2, keepalive=15):
+    """Server-Sent Events for one job: a ``job`` event whenever its status
+    changes, ending after it has finished"""
+    status = None
+    seen = notifier.sequence
+    idle_since = time.monotonic()
+    while True:
+        job = jobs.get(job_id)
+        jobs.db.session.rollback()
+        if job is None:
+            yield sse_message('error', {'message': f'Unknown job {job_id}'})
+            return
+        if job['status'] != status:
+            status = job['status']
+            yield sse_message('job', job)
+            if status in ('done', 'failed'):
+                return
+            idle_since = time.monotonic()
+        elif time.monotonic() - idle_since >= keepalive:
+            yield ': keepalive\n\n'
+            idle_since = time.monotonic()
+        seen = notifier.wait(seen, poll_interval)
@@ -0,0 +1,278 @@
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from face_encoders import make_encoder
+from face_index import make_index
+from gallery import FaceGallery
+from image_io import Frame
+from tracking import burst_encodings
+
+
+class PoolBusy(Exception):
+    """Raised when the recognition queue is already at its depth limit"""
+
+
+class StaleSnapshot(Exception):
+    """Raised in a worker when the gallery snapshot of a task is already gone"""
+
+
+class GallerySnapshot:
+    """A gallery's rows, ids and the given metadata columns copied into
+    shared memory.
+
+    Workers map the segments read-only and match against them in place, so
+    every process shares one physical copy of the gallery.
+    """
+
+    def __init__(self, gallery, columns):
+        self.segments = []
+        # Copy a consistent state: no roster change lands halfway through
+        with gallery.lock.reading():
+            self.version = gallery.version
+            self.descriptor = {'id': uuid.uuid4().hex, 'version': gallery.version, 'arrays': {}}
+
+            arrays = {'ids': gallery.ids, 'matrix': gallery.matrix}
+            for name in columns:
+                arrays[f'column:{name}'] = gallery.column(name)
+
+            for name, array in arrays.items():
+                array = np.ascontiguousarray(array)
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+                self.segments.append(shm)
+                self.descriptor['arrays'][name] = (shm.name, array.dtype.str, array.shape)
+
+    def close(self):
+        for shm in self.segments:
+            shm.close()
+            shm.unlink()
+        self.segments = []
+
+
+# Per-process state of a recognition worker
+_worker = {}
+
+
+def _init_worker(encoder_kind, encoder_options, gallery_options):
+    _worker['encoder'] = make_encoder(encoder_kind, **encoder_options)
+    _worker['gallery_options'] = gallery_options
+    _worker['gallery'] = None
+    _worker['snapshot_id'] = None
+    _worker['segments'] = []
+
+
+def _attach_snapshot(descriptor):
+    """Map a published snapshot and adopt it as this worker's gallery"""
+    segments = []
+    arrays = {}
+    try:
+        for name, (shm_name, dtype, shape) in descriptor['arrays'].items():
+            shm = shared_memory.SharedMemory(name=shm_name)
+            segments.append(shm)
+            array = np.ndarray(tuple(shape), dtype=np.dtype(dtype), buffer=shm.buf)
+            array.flags.writeable = False
+            arrays[name] = array
+    except FileNotFoundError:
+        for shm in segments:
+            shm.close()
+        raise StaleSnapshot(descriptor['id'])
+
+    options = _worker['gallery_options']
+    gallery = FaceGallery(
+        dim=options['dim'],
+        metric=options['metric'],
+        columns=options['columns'],
+        index=make_index(options['index'], options.get('index_path'), **options.get('index_options', {}))
+    )
+    metadata = {name: arrays[f'column:{name}'] for name in options['columns']}
+    gallery.adopt(arrays['ids'], arrays['matrix'], version=descriptor['version'], metadata=metadata)
+
+    # Drop the previous snapshot's views before unmapping it
+    old_segments = _worker['segments']
+    _worker['gallery'] = gallery
+    _worker['snapshot_id'] = descriptor['id']
+    _worker['segments'] = segments
+    for shm in old_segments:
+        try:
+            shm.close()
+        except BufferError:
+            pass
+
+
+def _current_gallery(descriptor, changes):
+    """This worker's gallery at the state a task was submitted against"""
+    if _worker['snapshot_id'] != descriptor['id']:
+        _attach_snapshot(descriptor)
+
+    # Catch up on changes broadcast since the snapshot was published
+    gallery = _worker['gallery']
+    gallery.apply_changes([change for change in changes if change[0] > gallery.version])
+    return gallery
+
+
+def _recognize(image_bytes, max_side, class_name, section, tolerance, fallback, descriptor, changes):
+    """Worker task: decode, detect, encode and match one frame.
+
+    Returns the number of faces found and the best (student_id, distance)
+    (or None) for each of them.
+    """
+    gallery = _current_gallery(descriptor, changes)
+    try:
+        face_encodings = _worker['encoder'].encode_faces(Frame(image_bytes, max_side=max_side))
+    except Exception as e:
+        print(f"Error encoding frame: {e}")
+        return 0, []
+    if len(face_encodings) == 0:
+        return 0, []
+    matches = gallery.best_matches(face_encodings, tolerance, class_name, section, fallback)
+    return len(face_encodings), matches
+
+
+def _recognize_burst(frames_bytes, max_side, class_name, section, tolerance, fallback, descriptor, changes,
+                     tracking):
+    """Worker task: track the faces of a burst of frames and match each
+    track's fused encoding (see tracking.burst_encodings).
+
+    Returns the number of tracks and the best match (or None) for each.
+    """
+    gallery = _current_gallery(descriptor, changes)
+    frames = [Frame(image_bytes, max_side=max_side) for image_bytes in frames_bytes]
+    tracks = burst_encodings(_worker['encoder'], frames, **tracking)
+    if not tracks:
+        return 0, []
+    matches = gallery.best_matches([encoding for encoding, _ in tracks], tolerance, class_name, section, fallback)
+    return len(tracks), matches
+
+
+class RecognitionPool:
+    """Process pool that runs detection, encoding and matching off the
+    request thread.
+
+    Each worker holds a read-only view of the gallery through a shared-memory
+    snapshot. Gallery updates reach workers as a delta list shipped with every
+    task, and a fresh snapshot is published once that list grows past
+    ``snapshot_every`` changes. At most ``max_pending`` frames may be queued or
+    running at once; beyond that ``submit`` raises PoolBusy.
+    """
+
+    def __init__(self, encoder_kind, gallery_options, workers=None, max_pending=None,
+                 snapshot_every=256, timeout=60, encoder_options=None):
+        self.columns = list(gallery_options['columns'])
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 4
+        self.snapshot_every = snapshot_every
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._snapshots = []
+        self._changes = []
+        # spawn rather than fork: forking a threaded web server is unsafe,
+        # and it is the only start method on Windows anyway
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(encoder_kind, encoder_options or {}, gallery_options)
+        )
+
+    def publish(self, gallery):
+        """Make the gallery's current state visible to the workers"""
+        with self._lock:
+            current = self._snapshots[-1] if self._snapshots else None
+            changes = gallery.changes_since(current.version) if current else None
+
+            if changes is None or len(changes) > self.snapshot_every:
+                self._snapshots.append(GallerySnapshot(gallery, self.columns))
+                # Keep the previous snapshot mapped for tasks already queued
+                while len(self._snapshots) > 2:
+                    self._snapshots.pop(0).close()
+                changes = []
+            self._changes = changes
+
+    def _reserve(self, count):
+        """Take ``count`` queue slots at once, or none and raise PoolBusy"""
+        taken = 0
+        while taken < count and self._slots.acquire(blocking=False):
+            taken += 1
+        if taken < count:
+            for _ in range(taken):
+                self._slots.release()
+            raise PoolBusy(f'Recognition queue is full ({self.max_pending} frames pending)')
+
+    def _submit(self, frame, class_name, section, tolerance, fallback):
+        """Queue one frame on a slot already reserved for it"""
+        try:
+            with self._lock:
+                descriptor = self._snapshots[-1].descriptor
+                changes = self._changes
+            future = self._executor.submit(
+                _recognize, frame.image_bytes, frame.max_side, class_name, section,
+                tolerance, fallback, descriptor, changes
+            )
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def submit(self, frame, class_name=None, section=None, tolerance=0.6, fallback=True):
+        """Queue one frame; returns a future of (face_count, matches)"""
+        self._reserve(1)
+        return self._submit(frame, class_name, section, tolerance, fallback)
+
+    def recognize(self, frames, class_name=None, section=None, tolerance=0.6, fallback=True):
+        """(face_count, matches) for each frame, processed in parallel.
+
+        All frames of a batch are admitted together or not at all.
+        """
+        options = (class_name, section, tolerance, fallback)
+        self._reserve(len(frames))
+        futures = [self._submit(frame, *options) for frame in frames]
+
+        results = []
+        for frame, future in zip(frames, futures):
+            try:
+                results.append(future.result(timeout=self.timeout))
+            except StaleSnapshot:
+                # The snapshot was replaced while queued; retry on the current one
+                results.append(self.submit(frame, *options).result(timeout=self.timeout))
+        return results
+
+    def recognize_burst(self, frames, class_name=None, section=None, tolerance=0.6, fallback=True, **tracking):
+        """(track count, matches) for a burst of frames of one scene.
+
+        The whole burst runs in one worker, since tracking is sequential;
+        it still takes one queue slot per frame.
+        """
+        self._reserve(len(frames))
+        try:
+            for attempt in range(2):
+                with self._lock:
+                    descriptor = self._snapshots[-1].descriptor
+                    changes = self._changes
+                future = self._executor.submit(
+                    _recognize_burst, [frame.image_bytes for frame in frames], frames[0].max_side,
+                    class_name, section, tolerance, fallback, descriptor, changes, tracking
+                )
+                try:
+                    return future.result(timeout=self.timeout)
+                except StaleSnapshot:
+                    # The snapshot was replaced while queued; retry on the current one
+                    if attempt:
+                        raise
+        finally:
+            for _ in frames:
+                self._slots.release()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            for snapshot in self._snapshots:
+                snapshot.close()
+            self._snapshots = []
@@ -0,0 +1,269 @@
+import csv
+import io
+import json
+from bisect import bisect_left
+from datetime import datetime
+
+from sqlalchemy import and_, func, true
+
+
+def parse_date(value, name):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'"{name}" must be a date in YYYY-MM-DD format, got {value!r}')
+
+
+def parse_date_range(args, max_days=366):
+    """(start, end) dates from ``from``/``to`` query arguments (YYYY-MM-DD)"""
+    if not args.get('from'):
+        raise ValueError('"from" date is required (YYYY-MM-DD)')
+    start = parse_date(args['from'], 'from')
+    end = parse_date(args['to'], 'to') if args.get('to') else start
+    if end < start:
+        raise ValueError('"to" must not be before "from"')
+    if (end - start).days >= max_days:
+        raise ValueError(f'Date range is limited to {max_days} days')
+    return start, end
+
+
+def scope_filters(Student, class_name=None, section=None):
+    filters = []
+    if class_name:
+        filters.append(Student.class_name == class_name)
+    if section:
+        filters.append(Student.section == section)
+    return filters
+
+
+def school_days_query(session, Attendance, start, end):
+    """Dates between ``start`` and ``end`` on which attendance was taken
+    anywhere in the school, so weekends and holidays are left out"""
+    return session.query(Attendance.date).filter(Attendance.date.between(start, end)).group_by(Attendance.date)
+
+
+def attendance_range_report(session, Student, Attendance, start, end, class_name=None, section=None,
+                            chronic_threshold=0.1):
+    """Aggregate attendance between ``start`` and ``end`` (inclusive).
+
+    School days are the dates on which attendance was taken anywhere in the
+    school, so weekends and holidays do not count as absences. A student is
+    only counted on school days on or after the day they were registered.
+    Students absent on at least ``chronic_threshold`` of their school days
+    are listed as chronically absent.
+
+    All counting happens in SQL GROUP BY queries; only one row per student,
+    per day and class, and per school day comes back.
+    """
+    in_range = Attendance.date.between(start, end)
+    scope = scope_filters(Student, class_name, section)
+
+    school_days = [day for (day,) in school_days_query(session, Attendance, start, end).order_by(Attendance.date)]
+
+    # Per student: days present within the range
+    per_student = session.query(
+        Student.student_id, Student.name, Student.class_name, Student.section, Student.created_at,
+        func.count(Attendance.id)
+    ).outerjoin(
+        Attendance, and_(Attendance.student_id == Student.student_id, in_range)
+    ).filter(*scope).group_by(Student.id).order_by(Student.class_name, Student.section, Student.name)
+
+    students = []
+    chronic = []
+    for student_id, name, class_value, section_value, created_at, present in per_student:
+        registered = created_at.date() if created_at else start
+        days = len(school_days) - bisect_left(school_days, registered)
+        # created_at is UTC; never count fewer school days than presences
+        days = max(days, present)
+        rate = round(present / days, 4) if days else None
+        row = {
+            'student_id': student_id,
+            'name': name,
+            'class': class_value,
+            'section': section_value,
+            'present': present,
+            'absent': days - present,
+            'days': days,
+            'rate': rate
+        }
+        students.append(row)
+        if days and (days - present) / days >= chronic_threshold:
+            chronic.append(row)
+    chronic.sort(key=lambda row: row['rate'])
+
+    # Per day and class/section: how many were present, against enrollment
+    daily = session.query(
+        Attendance.date, Student.class_name, Student.section, func.count(Attendance.id)
+    ).join(
+        Student, Student.student_id == Attendance.student_id
+    ).filter(in_range, *scope).group_by(
+        Attendance.date, Student.class_name, Student.section
+    ).order_by(Attendance.date, Student.class_name, Student.section)
+
+    enrolled = {
+        (class_value, section_value): count
+        for class_value, section_value, count in session.query(
+            Student.class_name, Student.section, func.count(Student.id)
+        ).filter(*scope).group_by(Student.class_name, Student.section)
+    }
+
+    total_days = sum(row['days'] for row in students)
+    total_present = sum(row['present'] for row in students)
+    return {
+        'from': str(start),
+        'to': str(end),
+        'school_days': [str(day) for day in school_days],
+        'summary': {
+            'students': len(students),
+            'present': total_present,
+            'absent': total_days - total_present,
+            'rate': round(total_present / total_days, 4) if total_days else None
+        },
+        'students': students,
+        'daily': [
+            {
+                'date': str(day),
+                'class': class_value,
+                'section': section_value,
+                'present': present,
+                'enrolled': enrolled.get((class_value, section_value), 0)
+            }
+            for day, class_value, section_value, present in daily
+        ],
+        'chronic_absentees': chronic
+    }
+
+
+EXPORT_COLUMNS = ['date', 'student_id', 'name', 'class', 'section', 'status', 'time_in', 'confidence']
+
+
+def roster_days(session, Student, Attendance, columns, scope, start, end):
+    """(day, *columns) for every scoped student on every school day from
+    ``start`` to ``end``, with that day's attendance columns or NULLs.
+
+    One query crosses the roster with the school days, as
+    attendance_range_report counts them.
+    """
+    days = school_days_query(session, Attendance, start, end).subquery()
+    return session.query(days.c.date, *columns).select_from(days).join(Student, true()).outerjoin(
+        Attendance, and_(Attendance.student_id == Student.student_id, Attendance.date == days.c.date)
+    ).filter(*scope).order_by(days.c.date, Student.class_name, Student.section, Student.name)
+
+
+def export_rows(session, Student, Attendance, start, end, class_name=None, section=None,
+                include_absent=False, batch_size=1000):
+    """Yield one dict per attendance record between ``start`` and ``end``.
+
+    With ``include_absent`` the whole (scoped) roster is listed for every
+    school day in the range, students not marked that day as ``Absent``,
+    even when nobody in the scope was marked. Results are fetched ``batch_size`` rows at a
+    time, so memory stays flat however long the range is.
+    """
+    scope = scope_filters(Student, class_name, section)
+    columns = (Student.student_id, Student.name, Student.class_name, Student.section, Student.created_at,
+               Attendance.status, Attendance.time_in, Attendance.confidence)
+
+    if include_absent:
+        query = roster_days(session, Student, Attendance, columns, scope, start, end)
+    else:
+        query = session.query(Attendance.date, *columns).join(
+            Student, Student.student_id == Attendance.student_id
+        ).filter(Attendance.date.between(start, end), *scope).order_by(
+            Attendance.date, Student.class_name, Student.section, Student.name
+        )
+    rows = query.yield_per(batch_size)
+
+    for day, student_id, name, class_value, section_value, created_at, status, time_in, confidence in rows:
+        if status is None and created_at and created_at.date() > day:
+            # Not registered yet on that day
+            continue
+        yield {
+            'date': str(day),
+            'student_id': student_id,
+            'name': name,
+            'class': class_value,
+            'section': section_value,
+            'status': status or 'Absent',
+            'time_in': time_in.strftime('%H:%M:%S') if time_in else None,
+            'confidence': round(confidence, 4) if confidence is not None else None
+        }
+
+
+def csv_chunks(rows, chunk_rows=500):
+    """Encode rows as CSV text, a header plus ``chunk_rows`` rows per chunk"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(rows, chunk_rows=500):
+    """Encode rows as newline-delimited JSON, ``chunk_rows`` rows per chunk"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row))
+        if len(lines) == chunk_rows:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': (csv_chunks, 'text/csv'),
+    'ndjson': (ndjson_chunks, 'application/x-ndjson'),
+}
+
+
+# Fields a client may ask /api/students for with ``fields=``
+STUDENT_FIELDS = ['student_id', 'name', 'class', 'section', 'photo_path', 'created_at']
+
+
+def roster_version(session, Student, StudentChange):
+    """Opaque version that changes whenever a student is added, re-enrolled or removed"""
+    change = session.query(func.max(StudentChange.id)).scalar() or 0
+    count, last_id = session.query(func.count(Student.id), func.max(Student.id)).one()
+    return f'{change}.{count}.{last_id or 0}'
+
+
+def student_page(session, Student, fields=None, class_name=None, section=None, after=None, limit=100):
+    """One page of the roster in id order, projected to ``fields``.
+
+    ``after`` is the cursor returned with the previous page. Returns the
+    rows and the cursor of the next page, or None on the last page.
+    """
+    columns = {
+        'student_id': Student.student_id,
+        'name': Student.name,
+        'class': Student.class_name,
+        'section': Student.section,
+        'photo_path': Student.photo_path,
+        'created_at': Student.created_at,
+    }
+    fields = fields or STUDENT_FIELDS
+    unknown = [field for field in fields if field not in columns]
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}')
+
+    query = session.query(Student.id, *[columns[field] for field in fields]).filter(
+        *scope_filters(Student, class_name, section)
+    )
+    if after is not None:
+        query = query.filter(Student.id > after)
+    # One extra row tells whether another page follows
+    rows = query.order_by(Student.id).limit(limit + 1).all()
+
+    students = []
+    for row in rows[:limit]:
+        student = dict(zip(fields, row[1:]))
+        if student.get('created_at') is not None:
+            student['created_at'] = student['created_at'].strftime('%Y-%m-%d %H:%M:%S')
+        students.append(student)
+    next_cursor = rows[limit - 1][0] if len(rows) > limit else None
+    return students, next_cursor
@@ -0,0 +1,132 @@
+import numpy as np
+
+from image_io import load_cv2
+
+
+class Track:
+    """One face followed across the frames of a burst.
+
+    Each observation is (frame index, encoder location, corners, quality).
+    """
+
+    def __init__(self, observation):
+        self.observations = [observation]
+
+    @property
+    def last(self):
+        return self.observations[-1]
+
+    def best(self, count):
+        """The ``count`` highest-quality observations"""
+        return sorted(self.observations, key=lambda observation: observation[3], reverse=True)[:count]
+
+
+def box_iou(a, b):
+    """Intersection over union of two (left, top, right, bottom) boxes"""
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+def face_quality(gray, corners):
+    """How well a face crop is likely to encode: its sharpness (variance of
+    the Laplacian, low for motion blur and closed or turned-away faces)
+    weighted by its size"""
+    height, width = gray.shape[:2]
+    left, top = max(0, corners[0]), max(0, corners[1])
+    right, bottom = min(width, corners[2]), min(height, corners[3])
+    crop = gray[top:bottom, left:right]
+    if crop.size == 0:
+        return 0.0
+    cv2 = load_cv2()
+    sharpness = cv2.Laplacian(crop, cv2.CV_64F).var() if cv2 is not None else crop.std() ** 2
+    return float(sharpness) * np.sqrt(crop.size)
+
+
+def link_tracks(frame_faces, iou_threshold=0.3, max_gap=1):
+    """Link the faces of consecutive frames into tracks.
+
+    ``frame_faces[i]`` holds (location, corners, quality) for each face of
+    frame ``i``. Faces are matched greedily, highest IoU first, to tracks
+    seen within the last ``max_gap`` + 1 frames; unmatched faces start new
+    tracks.
+    """
+    tracks = []
+    for index, faces in enumerate(frame_faces):
+        live = [track for track in tracks if index - track.last[0] <= max_gap + 1]
+        pairs = sorted(
+            ((box_iou(track.last[2], face[1]), track_number, face_number)
+             for track_number, track in enumerate(live)
+             for face_number, face in enumerate(faces)),
+            reverse=True
+        )
+        linked_tracks = set()
+        linked_faces = set()
+        for iou, track_number, face_number in pairs:
+            if iou < iou_threshold:
+                break
+            if track_number in linked_tracks or face_number in linked_faces:
+                continue
+            live[track_number].observations.append((index, *faces[face_number]))
+            linked_tracks.add(track_number)
+            linked_faces.add(face_number)
+
+        for face_number, face in enumerate(faces):
+            if face_number not in linked_faces:
+                tracks.append(Track((index, *face)))
+    return tracks
+
+
+def burst_encodings(encoder, frames, iou_threshold=0.3, min_hits=2, crops_per_track=1, max_gap=1):
+    """Fused encodings of the faces in a burst of frames of one scene.
+
+    Faces are detected in every (downscaled) frame and followed with IoU
+    tracking. Tracks seen in fewer than ``min_hits`` frames are dropped as
+    spurious detections. Only the ``crops_per_track`` sharpest crops of each
+    remaining track are encoded, and their mean is the track's encoding, so
+    the expensive encoding step runs once per student rather than once
+    per face per frame.
+
+    Returns one (encoding, frames seen in) pair per track.
+    """
+    frame_faces = []
+    for frame in frames:
+        try:
+            locations = encoder.detect_faces(frame)
+        except Exception as e:
+            print(f"Error detecting faces: {e}")
+            locations = []
+        faces = []
+        for location in locations:
+            corners = encoder.face_corners(location)
+            faces.append((location, corners, face_quality(frame.gray, corners)))
+        frame_faces.append(faces)
+
+    min_hits = min(min_hits, len(frames))
+    tracks = [track for track in link_tracks(frame_faces, iou_threshold, max_gap)
+              if len(track.observations) >= min_hits]
+
+    # Encode the chosen crops frame by frame, one encoder call per frame
+    wanted = {}
+    for track_number, track in enumerate(tracks):
+        for index, location, _, _ in track.best(crops_per_track):
+            wanted.setdefault(index, []).append((track_number, location))
+
+    crops = [[] for _ in tracks]
+    for index, items in sorted(wanted.items()):
+        try:
+            encodings = encoder.encode_locations(frames[index], [location for _, location in items])
+        except Exception as e:
+            print(f"Error encoding frame: {e}")
+            continue
+        for (track_number, _), encoding in zip(items, encodings):
+            crops[track_number].append(encoding)
+
+    return [
+        (np.mean(encodings, axis=0), len(track.observations))
+        for track, encodings in zip(tracks, crops) if encodings
+    ]